@@ -0,0 +1,57 @@
+from argparse import ArgumentParser
+from datetime import datetime
+from random import random
+from timeit import timeit
+
+from bson import json_util
+from bson.objectid import ObjectId
+
+import serializer
+
+
+def content_docs(n):
+    return [{
+        "_id": ObjectId(),
+        "user_id": ObjectId(),
+        "contest_id": ObjectId(),
+        "content": {
+            "data": "lorem ipsum dolor sit amet " * 4,
+            "type": "text",
+            "url": ""
+        },
+        "created": datetime.now(),
+        "votes": {
+            "total": 10,
+            "up": 6,
+            "down": 4,
+            "elo": 1500 + random() * 100
+        }
+    } for _ in range(n)]
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Compare serializer.dumps against json_util.dumps.")
+    parser.add_argument("-n", type=int, default=10000, help="Documents per response")
+    parser.add_argument("-r", type=int, default=10, help="Repetitions")
+    args = parser.parse_args()
+
+    docs = content_docs(args.n)
+
+    # Same output as json_util in the compatible format
+    expected = json_util.dumps({"data": docs})
+    assert serializer.dumps({"data": serializer.CONTENT.many(docs)}) == expected
+
+    t_json_util = timeit(lambda: json_util.dumps({"data": docs}), number=args.r) / args.r
+
+    print(f"{args.n} content documents, {args.r} repetitions")
+    print(f"json_util.dumps: {t_json_util * 1000:8.2f} ms")
+
+    for wire in serializer.FORMATS:
+        shape = serializer.Shape(
+            oids=("_id", "user_id", "contest_id"), dates=("created",), wire=wire)
+
+        t = timeit(
+            lambda: serializer.dumps({"data": shape.many(docs)}, wire=wire),
+            number=args.r) / args.r
+
+        print(f"serializer ({wire}): {t * 1000:8.2f} ms ({t_json_util / t:.1f}x)")
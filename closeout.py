@@ -0,0 +1,201 @@
+from argparse import ArgumentParser
+from datetime import datetime
+from time import time
+
+from bson.objectid import ObjectId
+from pymongo import DESCENDING, ASCENDING
+from pymongo.errors import BulkWriteError
+
+from cache import TTLCache
+from config import LOGGER as log
+from config import CONTEST_TTL, SNAPSHOT_PAGE
+
+
+# Fields of a content kept in the snapshot rows
+ROW_FIELDS = ("_id", "user_id", "content", "created", "votes")
+
+# Closed contests by id, cached for long (a contest never reopens)
+_closed = TTLCache(1000, CONTEST_TTL)
+CLOSED_TTL = 24 * 3600
+
+
+def snapshot(db, contest_id, page_size=SNAPSHOT_PAGE):
+    """
+    Freezes the ranking of a contest in `db.snapshots`.
+
+    Contents are ranked like the leaderboards (ELO desc, then _id), and
+    stored `page_size` per document as {contest_id, page, size, total,
+    rows}, every row with its position.
+
+    Returns
+    -------
+        int
+            Number of contents ranked
+    """
+
+    cursor = db.content.find(
+        {"contest_id": contest_id}, {f: 1 for f in ROW_FIELDS}
+    ).sort([("votes.elo", DESCENDING), ("_id", ASCENDING)])
+
+    rows = [dict(doc, position=i) for i, doc in enumerate(cursor, 1)]
+    pages = [rows[a:a + page_size] for a in range(0, len(rows), page_size)] or [[]]
+
+    db.snapshots.delete_many({"contest_id": contest_id})
+    db.snapshots.insert_many([
+        {"contest_id": contest_id, "page": page, "size": page_size, "total": len(rows),
+         "rows": chunk}
+        for page, chunk in enumerate(pages)
+    ])
+
+    return len(rows)
+
+
+def archive(db, contest_id, chunk=1000):
+    """
+    Moves the contents of a contest from `content` to `content_archive`.
+
+    Copies first, then deletes, so it can run again after a failure.
+
+    Returns
+    -------
+        int
+            Number of contents moved
+    """
+
+    moved = 0
+
+    while True:
+        docs = list(db.content.find({"contest_id": contest_id}).limit(chunk))
+
+        if not docs:
+            return moved
+
+        try:
+            db.content_archive.insert_many(docs, ordered=False)
+
+        except BulkWriteError as e:
+            # Already copied by a previous run
+            if any(err["code"] != 11000 for err in e.details["writeErrors"]):
+                raise
+
+        db.content.delete_many({"_id": {"$in": [d["_id"] for d in docs]}})
+        moved += len(docs)
+
+
+def close_contest(db, contest_id, page_size=SNAPSHOT_PAGE):
+    """
+    Closes a contest: snapshots its final ranking and archives its
+    contents, out of the live collection and its indexes.
+
+    The steps are recorded on the contest ("snapshot", then "closed"), so
+    a failed close-out can be run again.
+
+    Returns
+    -------
+        Object
+            The closed contest, None if it does not exist
+
+    Raises
+    ------
+        ValueError
+            If it is the current contest, or it has not ended yet
+    """
+
+    contest = db.contest.find_one({"_id": contest_id})
+
+    if contest is None:
+        return None
+
+    if contest.get("current"):
+        raise ValueError("The current contest cannot be closed")
+
+    if contest.get("end") is not None and contest["end"] > datetime.now():
+        raise ValueError("The contest has not ended yet")
+
+    if contest.get("closed") is not None:
+        return contest
+
+    if contest.get("snapshot") is None:
+        total = snapshot(db, contest_id, page_size)
+        db.contest.update_one({"_id": contest_id}, {"$set": {"snapshot": total}})
+
+    moved = archive(db, contest_id)
+    log.info(f"Contest {contest_id} closed, {moved} contents archived")
+
+    db.contest.update_one({"_id": contest_id}, {"$set": {"closed": datetime.now()}})
+    _closed.pop(contest_id)
+
+    return db.contest.find_one({"_id": contest_id})
+
+
+def is_closed(db, contest_id):
+    """If the contest is closed, cached."""
+
+    closed = _closed.get(contest_id)
+
+    if closed is None:
+        contest = db.contest.find_one({"_id": contest_id}, {"closed": 1}) or {}
+        closed = contest.get("closed") is not None
+        _closed.set(contest_id, closed, CLOSED_TTL if closed else None)
+
+    return closed
+
+
+def snapshot_page(db, contest_id, page):
+    """A page of the frozen ranking of a contest, None past the last one."""
+    return db.snapshots.find_one({"contest_id": contest_id, "page": page})
+
+
+def snapshot_around(db, contest_id, content_id, n):
+    """
+    Position of a content in a frozen ranking, and its `n` neighbors on
+    each side.
+
+    Returns
+    -------
+        int, list, int
+            Position (None if not ranked), neighbor rows and the number
+            of contents ranked
+    """
+
+    page = db.snapshots.find_one({"contest_id": contest_id, "rows._id": content_id})
+
+    if page is None:
+        return None, [], 0
+
+    size = page["size"]
+    row = next(r for r in page["rows"] if r["_id"] == content_id)
+    position = row["position"]
+
+    first = max(0, position - 1 - n) // size
+    last = (position - 1 + n) // size
+
+    rows = []
+
+    for doc in db.snapshots.find(
+            {"contest_id": contest_id, "page": {"$gte": first, "$lte": last}}).sort("page", 1):
+        rows += doc["rows"]
+
+    rows = [r for r in rows if abs(r["position"] - position) <= n]
+
+    return position, rows, page["total"]
+
+
+if __name__ == "__main__":
+    from database import db
+    from versions import versions
+
+    parser = ArgumentParser(description="Close a contest: snapshot its ranking and archive its content.")
+    parser.add_argument("contest_id")
+    parser.add_argument("--page-size", type=int, default=SNAPSHOT_PAGE)
+    args = parser.parse_args()
+
+    t = time()
+    contest = close_contest(db, ObjectId(args.contest_id), args.page_size)
+
+    if contest is None:
+        print(f"Contest {args.contest_id} not found.")
+
+    else:
+        versions.bump("ranking")
+        print(f"{contest['snapshot']} contents ranked: {time() - t:2.6} s.")
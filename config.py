@@ -1,9 +1,8 @@
 import logging
 
-from os import environ
+from os import environ, cpu_count
 
 from dotenv import load_dotenv
-from pymongo import MongoClient
 
 
 load_dotenv()
@@ -17,10 +16,129 @@ PORT = environ["PORT"]
 DEBUG = environ["DEBUG"]
 LOGGER = logging.getLogger(__name__)
 
+# Times a vote is retried when the content changed after it was read
+VOTE_RETRIES = int(environ.get("VOTE_RETRIES", 5))
+
+# Write-behind vote ingestion (opt-in)
+VOTE_BUFFER = bool(environ.get("VOTE_BUFFER", ""))
+VOTE_BUFFER_MS = int(environ.get("VOTE_BUFFER_MS", 100))
+VOTE_BUFFER_SIZE = int(environ.get("VOTE_BUFFER_SIZE", 500))
+VOTE_BUFFER_MAX = int(environ.get("VOTE_BUFFER_MAX", 10000))
+VOTE_BUFFER_TIMEOUT = float(environ.get("VOTE_BUFFER_TIMEOUT", 0.5))
+
+# Max votes in one POST /votes
+VOTES_MAX = int(environ.get("VOTES_MAX", 100))
+
+# Local append-only vote journal (opt-in): file path, and fsync after
+# every write
+JOURNAL_PATH = environ.get("JOURNAL_PATH", "")
+JOURNAL_FSYNC = bool(environ.get("JOURNAL_FSYNC", ""))
+
+# Seconds before the in-memory ranking is rebuilt from the db (0 = never)
+LEADERBOARD_TTL = float(environ.get("LEADERBOARD_TTL", 60))
+
+# Matchmaking: ELO band width, max bands between a pair, random draws
+# before giving up and seconds before the pool is rebuilt (0 = never)
+MATCH_BAND = float(environ.get("MATCH_BAND", 50))
+MATCH_SPREAD = int(environ.get("MATCH_SPREAD", 4))
+MATCH_TRIES = int(environ.get("MATCH_TRIES", 8))
+MATCH_TTL = float(environ.get("MATCH_TTL", 60))
+
+# Password hashing: pbkdf2 rounds, worker processes (0 = on the request
+# thread), jobs queued before rejecting and seconds to wait for a job
+HASH_ROUNDS = int(environ.get("HASH_ROUNDS", 10**6))
+HASH_WORKERS = int(environ.get("HASH_WORKERS", cpu_count() or 1))
+HASH_QUEUE = int(environ.get("HASH_QUEUE", 64))
+HASH_TIMEOUT = float(environ.get("HASH_TIMEOUT", 30))
+
+# Auth caches: decoded JWTs and user documents, max entries and seconds
+TOKEN_CACHE_SIZE = int(environ.get("TOKEN_CACHE_SIZE", 10000))
+TOKEN_CACHE_TTL = float(environ.get("TOKEN_CACHE_TTL", 300))
+USER_CACHE_SIZE = int(environ.get("USER_CACHE_SIZE", 10000))
+USER_CACHE_TTL = float(environ.get("USER_CACHE_TTL", 30))
+
+# Seconds the current contest is cached
+CONTEST_TTL = float(environ.get("CONTEST_TTL", 5))
+
+# Glicko-2 engine (contests with "rating": "glicko2"): system constant,
+# and rating deviation and volatility of new content
+GLICKO_TAU = float(environ.get("GLICKO_TAU", 0.5))
+GLICKO_RD = float(environ.get("GLICKO_RD", 350))
+GLICKO_VOL = float(environ.get("GLICKO_VOL", 0.06))
+
+# Contents per ranking snapshot document of closed contests
+SNAPSHOT_PAGE = int(environ.get("SNAPSHOT_PAGE", 100))
+
+# Ids of the users allowed to use admin endpoints, comma separated
+ADMIN_USERS = set(u for u in environ.get("ADMIN_USERS", "").split(",") if u)
+
+# Rate limits by endpoint (Flask endpoint name, e.g. "api.vote_content"),
+# as "endpoint=rate:burst" (requests per second, bucket size), comma
+# separated. Endpoints not listed are not limited.
+# Keyed by user for authenticated endpoints, by IP for open ones.
+RATE_LIMITS = {
+	endpoint: tuple(float(v) for v in limit.split(":"))
+	for endpoint, limit in (
+		item.split("=") for item in environ.get(
+			"RATE_LIMITS",
+			"api.vote_content=5:20,api.vote_many=1:10,api.get_user_stack=10:30,api.register=0.2:5,api.login=1:10"
+		).split(",") if item
+	)
+}
+
+# Rate limiter buckets kept in memory, and locks they are spread over
+RATE_LIMIT_SIZE = int(environ.get("RATE_LIMIT_SIZE", 100000))
+RATE_LIMIT_STRIPES = int(environ.get("RATE_LIMIT_STRIPES", 64))
+
+# ETags: seconds a version counter read is cached (and between flushes of
+# the bumps), counters cached, and seconds /contest is cached for by
+# clients at most (its progress moves)
+VERSION_TTL = float(environ.get("VERSION_TTL", 1))
+VERSION_CACHE_SIZE = int(environ.get("VERSION_CACHE_SIZE", 10000))
+CONTEST_ETAG_PERIOD = int(environ.get("CONTEST_ETAG_PERIOD", 60))
+
+# Index check at startup: "create", "verify" or "warn"
+INDEX_MODE = environ.get("INDEX_MODE", "create")
+
+# Voted pairs filter: pairs per user before it starts over, false
+# positive rate, users kept in memory and new pairs between saves
+SEEN_CAPACITY = int(environ.get("SEEN_CAPACITY", 1000))
+SEEN_ERROR = float(environ.get("SEEN_ERROR", 0.01))
+SEEN_USERS = int(environ.get("SEEN_USERS", 10000))
+SEEN_SAVE_EVERY = int(environ.get("SEEN_SAVE_EVERY", 10))
+
+# Request and Mongo metrics at /metrics (empty to disable)
+METRICS = bool(environ.get("METRICS", "1"))
+
+# Page size of list endpoints: default and max
+PAGE_LIMIT = int(environ.get("PAGE_LIMIT", 100))
+PAGE_MAX = int(environ.get("PAGE_MAX", 1000))
+
+# JSON wire format: "extended" ($oid / $date, like bson.json_util) or
+# "plain" (ids as strings, ISO dates)
+WIRE_FORMAT = environ.get("WIRE_FORMAT", "extended")
+
+# Bytes per chunk of streamed responses
+STREAM_CHUNK = int(environ.get("STREAM_CHUNK", 64 * 1024))
+
+# Hours of vote activity returned by default, and at most
+ACTIVITY_HOURS = int(environ.get("ACTIVITY_HOURS", 48))
+ACTIVITY_MAX_HOURS = int(environ.get("ACTIVITY_MAX_HOURS", 24 * 90))
+
+# Mongo connection, opened lazily by database.py
 if bool(environ["LOCAL"]):
-	mongo = MongoClient(environ["MONGO_HOST"], int(environ["MONGO_PORT"]))
-	DB = mongo.jiz
+	MONGO_URI = f"mongodb://{environ['MONGO_HOST']}:{int(environ['MONGO_PORT'])}"
 
 else:
-	mongo = MongoClient(environ["MONGO_URI"])
-	DB = mongo.jiz
\ No newline at end of file
+	MONGO_URI = environ["MONGO_URI"]
+
+MONGO_DB = environ.get("MONGO_DB", "jiz")
+
+# Connections per process, timeouts in ms and wire compressors, comma
+# separated (zstd, snappy, zlib)
+MONGO_POOL_SIZE = int(environ.get("MONGO_POOL_SIZE", 100))
+MONGO_MIN_POOL_SIZE = int(environ.get("MONGO_MIN_POOL_SIZE", 0))
+MONGO_CONNECT_TIMEOUT_MS = int(environ.get("MONGO_CONNECT_TIMEOUT_MS", 5000))
+MONGO_SERVER_TIMEOUT_MS = int(environ.get("MONGO_SERVER_TIMEOUT_MS", 5000))
+MONGO_SOCKET_TIMEOUT_MS = int(environ.get("MONGO_SOCKET_TIMEOUT_MS", 0)) or None
+MONGO_COMPRESSORS = environ.get("MONGO_COMPRESSORS", "")
@@ -0,0 +1,90 @@
+from datetime import datetime
+from threading import Lock
+from time import monotonic
+
+from bson.objectid import ObjectId
+from pymongo import ReturnDocument
+
+from config import CONTEST_TTL
+
+
+class ContestRegistry:
+    """
+    Keeps the current contest in memory.
+
+    It is read again from the db every `ttl` seconds, so other processes
+    pick up a switch, or at once after a `switch` on this one.
+    """
+
+    def __init__(self, ttl=CONTEST_TTL):
+        self.ttl = ttl
+        self.loaded = None
+
+        self._current = None
+        self._lock = Lock()
+
+    def refresh(self, db):
+        contest = db.contest.find_one({"current": True})
+
+        with self._lock:
+            self._current, self.loaded = contest, monotonic()
+
+        return contest
+
+    def current(self, db):
+        """Returns the current contest, None if there is none."""
+
+        with self._lock:
+            if self.loaded is not None and monotonic() - self.loaded <= self.ttl:
+                return self._current
+
+        return self.refresh(db)
+
+    def switch(self, db, contest_id):
+        """
+        Makes a contest the current one.
+
+        Parameters
+        ----------
+            contest_id: str or ObjectId
+                Id of the contest
+
+        Returns
+        -------
+            Object
+                The new current contest, None if it does not exist or
+                it is closed (see closeout.py)
+        """
+
+        contest_id = ObjectId(contest_id)
+
+        contest = db.contest.find_one_and_update(
+            {"_id": contest_id, "closed": None}, {"$set": {"current": True}},
+            return_document=ReturnDocument.AFTER)
+
+        if contest is None:
+            return None
+
+        db.contest.update_many(
+            {"current": True, "_id": {"$ne": contest_id}}, {"$set": {"current": False}})
+
+        with self._lock:
+            self._current, self.loaded = contest, monotonic()
+
+        return contest
+
+    def clear(self):
+        with self._lock:
+            self._current, self.loaded = None, None
+
+    @staticmethod
+    def progress(contest, now=None):
+        """Elapsed fraction of a contest, from its start and end."""
+
+        now = now or datetime.now()
+        start, end = contest["start"].timestamp(), contest["end"].timestamp()
+
+        return (now.timestamp() - start) / (end - start)
+
+
+contests = ContestRegistry()
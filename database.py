@@ -0,0 +1,109 @@
+import os
+
+from threading import Lock
+
+from flask import current_app, has_app_context
+from pymongo import MongoClient
+from werkzeug.local import LocalProxy
+
+from config import (
+    MONGO_URI,
+    MONGO_DB,
+    MONGO_POOL_SIZE,
+    MONGO_MIN_POOL_SIZE,
+    MONGO_CONNECT_TIMEOUT_MS,
+    MONGO_SERVER_TIMEOUT_MS,
+    MONGO_SOCKET_TIMEOUT_MS,
+    MONGO_COMPRESSORS
+)
+
+
+class Mongo:
+    """
+    Lazily connected, fork-safe Mongo client.
+
+    The client is created on first use, and again if the process id
+    changed since, so forked workers never share the connection pool of
+    their parent. Settings default to the config ones and can be
+    overridden by the app config (same keys) in `init_app`.
+    """
+
+    def __init__(self):
+        self.settings = {
+            "MONGO_URI": MONGO_URI,
+            "MONGO_DB": MONGO_DB,
+            "MONGO_POOL_SIZE": MONGO_POOL_SIZE,
+            "MONGO_MIN_POOL_SIZE": MONGO_MIN_POOL_SIZE,
+            "MONGO_CONNECT_TIMEOUT_MS": MONGO_CONNECT_TIMEOUT_MS,
+            "MONGO_SERVER_TIMEOUT_MS": MONGO_SERVER_TIMEOUT_MS,
+            "MONGO_SOCKET_TIMEOUT_MS": MONGO_SOCKET_TIMEOUT_MS,
+            "MONGO_COMPRESSORS": MONGO_COMPRESSORS
+        }
+
+        # Extra MongoClient kwargs, e.g. event_listeners
+        self.options = {}
+
+        self._client = None
+        self._pid = None
+        self._lock = Lock()
+
+    def init_app(self, app):
+        for key in self.settings:
+            if key in app.config:
+                self.settings[key] = app.config[key]
+
+        self.close()
+        app.extensions["mongo"] = self
+
+    def connect(self):
+        s = self.settings
+        compressors = [c for c in s["MONGO_COMPRESSORS"].split(",") if c]
+
+        kwargs = dict(
+            maxPoolSize=s["MONGO_POOL_SIZE"],
+            minPoolSize=s["MONGO_MIN_POOL_SIZE"],
+            connectTimeoutMS=s["MONGO_CONNECT_TIMEOUT_MS"],
+            serverSelectionTimeoutMS=s["MONGO_SERVER_TIMEOUT_MS"],
+            socketTimeoutMS=s["MONGO_SOCKET_TIMEOUT_MS"],
+            connect=False,
+            **self.options)
+
+        if compressors:
+            kwargs["compressors"] = compressors
+
+        return MongoClient(s["MONGO_URI"], **kwargs)
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None or self._pid != os.getpid():
+                self._client = self.connect()
+                self._pid = os.getpid()
+
+            return self._client
+
+    @property
+    def db(self):
+        return self.client[self.settings["MONGO_DB"]]
+
+    def close(self):
+        with self._lock:
+            if self._client is not None and self._pid == os.getpid():
+                self._client.close()
+
+            self._client, self._pid = None, None
+
+
+mongo = Mongo()
+
+
+def get_db():
+    """The database of the current app, or the default one outside of it."""
+
+    if has_app_context():
+        return current_app.extensions.get("mongo", mongo).db
+
+    return mongo.db
+
+
+db = LocalProxy(get_db)
@@ -1,9 +1,30 @@
 from config import LOGGER as log
-from config import DB as db
+from config import VOTE_RETRIES, USER_CACHE_SIZE, USER_CACHE_TTL
 from bson.objectid import ObjectId
+from pymongo import ReturnDocument, UpdateOne
 
+from cache import TTLCache
+from database import db
+from ratings import update_rating
+from rollups import record
+from scores import scored, scores_of
 from utils import error
 
+user_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+
+# Called with the updated contents every time votes are applied
+vote_listeners = []
+
+
+def notify_vote(contents):
+	for listener in vote_listeners:
+		try:
+			listener(contents)
+
+		except Exception as e:
+			log.error(f"Vote listener {listener} failed: {e}")
+
+
 def db_get_user(data):
 	"""
 	Gets a user from the db by it's username
@@ -28,9 +49,203 @@ def db_get_user(data):
 	except Exception as e:
 		return error(message=str(e))
 
+	user = user_cache.get(user_id)
+
+	if user is not None:
+		return user
+
 	user = db.users.find_one({"_id": user_id})
 
 	if user is None:
 		return error("User not found", 404)
 
+	user_cache.set(user_id, user)
+
 	return user
+
+
+def invalidate_user(user_id):
+	"""
+	Drops a user from the cache. Call it after updating the user.
+
+	Parameters
+	----------
+		user_id: ObjectId or str
+			Id of the user
+	"""
+
+	user_cache.pop(ObjectId(user_id))
+
+
+def db_vote_side(content, opponent, won, retries=VOTE_RETRIES):
+	"""
+	Applies one side of a vote with a single atomic update.
+
+	The update is checked against the `votes.total` read. If someone voted
+	the content in between, it is read again and the update recomputed,
+	up to `retries` times. After that the last computed delta is applied
+	unchecked, so the vote is never lost.
+
+	Parameters
+	----------
+		content: Object
+			Content being updated, as read from the db
+
+		opponent: Object
+			The other content of the vote
+
+		won: bool
+			If `content` is the winner
+
+		retries: int
+			Max number of version checked attempts
+
+	Returns
+	-------
+		Object
+			The updated content, None if it does not exist anymore
+	"""
+
+	side = 0 if won else 1
+
+	for _ in range(retries):
+		pair = (content, opponent) if won else (opponent, content)
+		query, update = update_rating(*pair)[side]
+
+		updated = db.content.find_one_and_update(
+			query, scored(update), return_document=ReturnDocument.AFTER)
+
+		if updated is not None:
+			return updated
+
+		content = db.content.find_one({"_id": content["_id"]})
+
+		if content is None:
+			return None
+
+	log.warning(f"Vote on {content['_id']} applied after {retries} retries")
+
+	pair = (content, opponent) if won else (opponent, content)
+	query, update = update_rating(*pair)[side]
+
+	return db.content.find_one_and_update(
+		{"_id": query["_id"]}, scored(update), return_document=ReturnDocument.AFTER)
+
+
+def db_vote(win, los):
+	"""
+	Applies a vote to two contents, race free.
+
+	Both contents are rated against the ratings read by the caller, each
+	one with its own atomic update (see `db_vote_side`).
+
+	Parameters
+	----------
+		win: Object
+			Winner content
+
+		los: Object
+			Loser content
+
+	Returns
+	-------
+		Object, Object
+			The updated winner and loser, resp.
+	"""
+
+	win, los = db_vote_side(win, los, True), db_vote_side(los, win, False)
+	notify_vote([win, los])
+
+	return win, los
+
+
+def inc_doc(doc, inc):
+	"""
+	Applies an `$inc` update in place on an in-memory document.
+
+	Parameters
+	----------
+		doc: Object
+			The document
+
+		inc: Object
+			`$inc` operand, with dotted keys
+	"""
+
+	for key, value in inc.items():
+		*path, last = key.split(".")
+		target = doc
+
+		for k in path:
+			target = target.setdefault(k, {})
+
+		target[last] = target.get(last, 0) + value
+
+
+def db_vote_many(votes, content=None):
+	"""
+	Applies an ordered batch of votes.
+
+	The ELO is chained in memory through `update_rating`, so every vote sees
+	the ratings left by the previous ones. The result is written with one
+	`bulk_write` of the accumulated increments (and scores) on `content`
+	and one `insert_many` on `votes`, then the rollups are updated.
+
+	Parameters
+	----------
+		votes: list
+			Vote documents, with keys "user", "win", "los" and "created"
+
+		content: dict, optional
+			The contents voted by id, if already fetched. Updated in
+			place.
+
+	Returns
+	-------
+		list, dict
+			The votes applied, and the updated contents by id. Votes on
+			contents that do not exist are skipped.
+	"""
+
+	if content is None:
+		ids = {v["win"] for v in votes} | {v["los"] for v in votes}
+		content = {c["_id"]: c for c in db.content.find({"_id": {"$in": list(ids)}})}
+
+	applied, incs = [], {}
+
+	for vote in votes:
+		win, los = content.get(vote["win"]), content.get(vote["los"])
+
+		if win is None or los is None:
+			log.warning(f"Vote skipped, content not found: {vote}")
+			continue
+
+		for doc, (_, update) in zip((win, los), update_rating(win, los)):
+			inc = incs.setdefault(doc["_id"], {})
+
+			for key, value in update["$inc"].items():
+				inc[key] = inc.get(key, 0) + value
+
+			inc_doc(doc, update["$inc"])
+
+		applied.append(vote)
+
+	if not applied:
+		return applied, {}
+
+	db.content.bulk_write(
+		[UpdateOne({"_id": _id}, scored({"$inc": inc})) for _id, inc in incs.items()],
+		ordered=False)
+
+	db.votes.insert_many(applied, ordered=True)
+
+	updated = {_id: content[_id] for _id in incs}
+
+	# As the pipeline of `scored` did in the db
+	for doc in updated.values():
+		doc["scores"] = scores_of(doc["votes"])
+
+	notify_vote(list(updated.values()))
+	record(db, applied, updated)
+
+	return applied, updated
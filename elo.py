@@ -31,8 +31,11 @@ def update_elo(win, los):
     
     Returns
     -------
-        str, str
-            Update queries for winner and looser, resp.
+        tuple, tuple
+            (filter, update) queries for winner and looser, resp.
+            The update increments the counters and the ELO by its delta,
+            and the filter only matches while `votes.total` is the one
+            read, so it acts as a version check.
     """
 
     rating_win, rating_los = win["votes"]["elo"], los["votes"]["elo"]
@@ -55,28 +58,22 @@ def update_elo(win, los):
 
 
     win_query = (
-        {"_id": win["_id"]},
+        {"_id": win["_id"], "votes.total": win["votes"]["total"]},
         {
-            "$set": {
-                "votes": {
-                    "total": int(win["votes"]["total"] + 1),
-                    "elo": win_elo,
-                    "up": int(win["votes"]["up"] + 1),
-                    "down": int(win["votes"]["down"])
-                }
+            "$inc": {
+                "votes.total": 1,
+                "votes.elo": win_elo - rating_win,
+                "votes.up": 1
             }
         })
 
     los_query = (
-        {"_id": los["_id"]},
+        {"_id": los["_id"], "votes.total": los["votes"]["total"]},
         {
-            "$set": {
-                "votes": {
-                    "total": int(los["votes"]["total"] + 1),
-                    "elo": los_elo,
-                    "up": int(los["votes"]["up"]),
-                    "down": int(los["votes"]["down"] + 1)
-                }
+            "$inc": {
+                "votes.total": 1,
+                "votes.elo": los_elo - rating_los,
+                "votes.down": 1
             }
         })
 
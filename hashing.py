@@ -0,0 +1,157 @@
+import os
+
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from threading import BoundedSemaphore, Lock
+
+from passlib.hash import pbkdf2_sha256
+
+from config import HASH_ROUNDS, HASH_WORKERS, HASH_QUEUE, HASH_TIMEOUT
+
+
+class HashUnavailable(Exception):
+    """Raised when a hashing job cannot be done now (see subclasses)."""
+
+
+class HashQueueFull(HashUnavailable):
+    """Raised when there are too many pending hashing jobs."""
+
+
+class HashTimeout(HashUnavailable):
+    """Raised when a hashing job did not finish in time, or its worker died."""
+
+
+def _hash(password, rounds):
+    return pbkdf2_sha256.hash(password, rounds=rounds, salt_size=2**4)
+
+
+def _verify(password, hashed, rounds):
+    if not pbkdf2_sha256.verify(password, hashed):
+        return False, None
+
+    if pbkdf2_sha256.using(rounds=rounds).needs_update(hashed):
+        return True, _hash(password, rounds)
+
+    return True, None
+
+
+class HashService:
+    """
+    Password hashing off the request thread.
+
+    Jobs run on a process pool of `workers` processes, created lazily (and
+    again after a fork). At most `workers + queue` jobs are pending, any
+    other one is rejected at once with `HashQueueFull`. With 0 workers
+    the jobs run on the calling thread.
+    """
+
+    def __init__(self, workers=HASH_WORKERS, queue=HASH_QUEUE,
+                 rounds=HASH_ROUNDS, timeout=HASH_TIMEOUT):
+        self.workers = workers
+        self.rounds = rounds
+        self.timeout = timeout
+        self.capacity = workers + queue
+        self.pending = 0
+
+        self._slots = BoundedSemaphore(self.capacity)
+        self._lock = Lock()
+        self._pool = None
+        self._pid = None
+
+    @property
+    def pool(self):
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+                self._pid = os.getpid()
+
+            return self._pool
+
+    def _run(self, fn, *args):
+        if self.workers == 0:
+            return fn(*args)
+
+        if not self._slots.acquire(blocking=False):
+            raise HashQueueFull()
+
+        with self._lock:
+            self.pending += 1
+
+        try:
+            future = self.pool.submit(fn, *args)
+
+        except BrokenProcessPool:
+            self._done()
+            self._reset()
+            raise HashTimeout("Hashing pool is broken")
+
+        except Exception:
+            self._done()
+            raise
+
+        # The slot is freed when the job is done, not when the caller
+        # stops waiting, so the executor never holds more than capacity
+        future.add_done_callback(self._done)
+
+        try:
+            return future.result(timeout=self.timeout)
+
+        except TimeoutError:
+            raise HashTimeout(f"Hashing job took more than {self.timeout} s")
+
+        except BrokenProcessPool:
+            self._reset()
+            raise HashTimeout("Hashing worker died")
+
+    def _done(self, future=None):
+        with self._lock:
+            self.pending -= 1
+
+        self._slots.release()
+
+    def _reset(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                self._pool = None
+
+    def hash(self, password):
+        """
+        Hashes a password with the configured rounds.
+
+        Raises
+        ------
+            HashUnavailable
+                If the queue is full (HashQueueFull), or the job timed
+                out or failed (HashTimeout)
+        """
+
+        return self._run(_hash, password, self.rounds)
+
+    def verify(self, password, hashed):
+        """
+        Verifies a password.
+
+        Returns
+        -------
+            bool, str
+                If the password is valid, and its new hash if it was
+                hashed with other rounds (None otherwise)
+
+        Raises
+        ------
+            HashUnavailable
+                If the queue is full (HashQueueFull), or the job timed
+                out or failed (HashTimeout)
+        """
+
+        return self._run(_verify, password, hashed, self.rounds)
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None and self._pid == os.getpid():
+                self._pool.shutdown()
+
+            self._pool = None
+
+
+hasher = HashService()
@@ -0,0 +1,137 @@
+from pymongo import ASCENDING, DESCENDING
+
+from config import LOGGER as log
+from config import INDEX_MODE
+from scores import SCORES
+
+
+# Indexes by collection, as (keys, options)
+INDEXES = {
+    "users": [
+        ([("username", ASCENDING)], {"unique": True}),
+        ([("email", ASCENDING)], {"unique": True}),
+    ],
+
+    "content": [
+        # One content per user and contest
+        ([("user_id", ASCENDING), ("contest_id", ASCENDING)], {"unique": True}),
+
+        # /content/user/<id>, paginated by _id
+        ([("user_id", ASCENDING), ("_id", ASCENDING)], {}),
+
+        # /ranking keyset
+        ([("votes.elo", DESCENDING), ("_id", ASCENDING)], {}),
+
+        # Contest leaderboards
+        ([("contest_id", ASCENDING), ("votes.elo", DESCENDING)], {}),
+
+        # /ranking2 keyset, by score
+        *[
+            ([("scores." + score, DESCENDING), ("_id", ASCENDING)],
+             {"partialFilterExpression": {"votes.total": {"$gt": 0}}})
+            for score in SCORES
+        ],
+    ],
+
+    "contest": [
+        ([("current", ASCENDING)], {}),
+    ],
+
+    "votes": [
+        # Replays
+        ([("created", ASCENDING)], {}),
+    ],
+
+    # Contents of closed contests
+    "content_archive": [
+        ([("contest_id", ASCENDING)], {}),
+
+        # /content/user/<id>, paginated by _id
+        ([("user_id", ASCENDING), ("_id", ASCENDING)], {}),
+    ],
+
+    # Final rankings of closed contests, by page
+    "snapshots": [
+        ([("contest_id", ASCENDING), ("page", ASCENDING)], {"unique": True}),
+        ([("contest_id", ASCENDING), ("rows._id", ASCENDING)], {}),
+    ],
+
+    # Hourly buckets, one per content or contest and hour
+    "rollups_content": [
+        ([("content_id", ASCENDING), ("hour", ASCENDING)], {"unique": True}),
+    ],
+
+    "rollups_contest": [
+        ([("contest_id", ASCENDING), ("hour", ASCENDING)], {"unique": True}),
+    ],
+}
+
+
+class MissingIndexes(Exception):
+    """Raised when declared indexes are missing in the db."""
+
+
+def ensure_indexes(db):
+    """Creates the declared indexes, does nothing for the existing ones."""
+
+    for collection, indexes in INDEXES.items():
+        for keys, options in indexes:
+            db[collection].create_index(keys, **options)
+
+
+def missing_indexes(db):
+    """
+    Checks the declared indexes against the db.
+
+    Returns
+    -------
+        list
+            (collection, keys, options) of every index missing, or with
+            other options (unique) than declared
+    """
+
+    missing = []
+
+    for collection, indexes in INDEXES.items():
+        existing = {
+            tuple((k, int(d)) for k, d in info["key"]): info.get("unique", False)
+            for info in db[collection].index_information().values()
+        }
+
+        for keys, options in indexes:
+            if existing.get(tuple(keys)) != options.get("unique", False):
+                missing.append((collection, keys, options))
+
+    return missing
+
+
+def bootstrap_indexes(db, mode=INDEX_MODE):
+    """
+    Startup index check.
+
+    Parameters
+    ----------
+        mode: str
+            "create" creates the missing indexes and then verifies them,
+            "verify" only verifies them and "warn" only logs the missing
+            ones
+
+    Raises
+    ------
+        MissingIndexes
+            If any index is missing, except with mode "warn"
+    """
+
+    if mode == "create":
+        try:
+            ensure_indexes(db)
+        except Exception as e:
+            log.error(f"Could not create indexes: {e}")
+
+    missing = missing_indexes(db)
+
+    for collection, keys, options in missing:
+        log.warning(f"Missing index on {collection}: {keys} {options}")
+
+    if missing and mode != "warn":
+        raise MissingIndexes(f"{len(missing)} indexes missing")
@@ -0,0 +1,131 @@
+import atexit
+
+from queue import Queue, Empty
+from threading import Event, Lock, Thread
+from time import monotonic
+
+from config import LOGGER as log
+from config import (
+    VOTE_BUFFER_MS,
+    VOTE_BUFFER_SIZE,
+    VOTE_BUFFER_MAX,
+    VOTE_BUFFER_TIMEOUT
+)
+
+from db_utils import db_vote_many
+
+
+class VoteBuffer:
+    """
+    Write-behind vote ingestion.
+
+    Votes are queued in-process and applied in ordered batches by a
+    background thread, every `flush_ms` milliseconds or `flush_size` votes,
+    whatever comes first. Each batch is applied with `db_vote_many`.
+
+    The queue is bounded by `max_depth`: once full, `put` blocks up to
+    `timeout` seconds and then raises `queue.Full`, so callers can reject
+    the vote. Pending votes are flushed on `close`, which runs at exit.
+    """
+
+    def __init__(self, flush_ms=VOTE_BUFFER_MS, flush_size=VOTE_BUFFER_SIZE,
+                 max_depth=VOTE_BUFFER_MAX, timeout=VOTE_BUFFER_TIMEOUT):
+        self.flush_ms = flush_ms
+        self.flush_size = flush_size
+        self.timeout = timeout
+
+        self.queue = Queue(maxsize=max_depth)
+        self.flushed = 0
+        self.failed = 0
+
+        self._lock = Lock()
+        self._closing = Event()
+        self._thread = None
+
+    @property
+    def depth(self):
+        """Number of votes waiting to be flushed."""
+        return self.queue.qsize()
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+
+            self._closing.clear()
+            self._thread = Thread(target=self._run, name="vote-buffer", daemon=True)
+            self._thread.start()
+
+        atexit.register(self.close)
+
+    def put(self, vote):
+        """
+        Queues a vote.
+
+        Parameters
+        ----------
+            vote: Object
+                Vote document, see `db_vote_many`
+
+        Raises
+        ------
+            queue.Full
+                If the buffer is still full after `timeout` seconds
+        """
+
+        if self._thread is None or not self._thread.is_alive():
+            self.start()
+
+        self.queue.put(vote, timeout=self.timeout)
+
+    def close(self):
+        """Stops the flushing thread after flushing all pending votes."""
+
+        atexit.unregister(self.close)
+        self._closing.set()
+
+        if self._thread is not None:
+            self._thread.join()
+
+        # Anything queued after the thread finished
+        self.flush(self._collect(block=False))
+
+    def flush(self, batch):
+        if not batch:
+            return
+
+        try:
+            applied, _ = db_vote_many(batch)
+            self.flushed += len(applied)
+
+        except Exception as e:
+            self.failed += len(batch)
+            log.error(f"Could not flush {len(batch)} votes: {e}")
+
+    def _collect(self, block=True):
+        batch = []
+        deadline = monotonic() + self.flush_ms / 1000
+
+        while len(batch) < self.flush_size:
+            timeout = deadline - monotonic()
+
+            try:
+                if block and timeout > 0:
+                    batch.append(self.queue.get(timeout=timeout))
+                else:
+                    batch.append(self.queue.get_nowait())
+
+            except Empty:
+                break
+
+        return batch
+
+    def _run(self):
+        while not self._closing.is_set():
+            self.flush(self._collect())
+
+        while self.depth:
+            self.flush(self._collect(block=False))
+
+
+vote_buffer = VoteBuffer()
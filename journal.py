@@ -0,0 +1,249 @@
+import os
+
+from argparse import ArgumentParser
+from datetime import datetime, timedelta
+from struct import Struct
+from threading import Lock
+from time import time
+
+import numpy as np
+
+from bson.objectid import ObjectId
+
+from config import LOGGER as log
+from config import JOURNAL_PATH, JOURNAL_FSYNC
+from replay import EPOCH, MS
+
+
+MAGIC = b"JIZVOTES"
+VERSION = 1
+
+# Magic, version, record size
+HEADER = Struct("<8sII")
+
+# Winner, loser and user ids, created (ms since the epoch)
+RECORD = Struct("<12s12s12sq")
+
+DTYPE = np.dtype([("win", "S12"), ("los", "S12"), ("user", "S12"), ("created", "<i8")])
+
+
+def _oid(value):
+    """ObjectId of an "S12" field, NumPy strips its trailing zero bytes."""
+    return ObjectId(bytes(value).ljust(12, b"\0"))
+
+
+def pack(vote):
+    return RECORD.pack(
+        vote["win"].binary, vote["los"].binary, vote["user"].binary,
+        (vote["created"] - EPOCH) // MS)
+
+
+class Journal:
+    """
+    Append-only file of fixed-size vote records.
+
+    Every record is one `os.write` on a file opened with O_APPEND, so
+    the workers of a server can share the journal. The file is opened on
+    first use, and again if the process id changed (see database.py).
+    A torn record at the end, from a crash, is ignored by `read`.
+
+    Parameters
+    ----------
+        path: str
+            Journal file, "" to disable it
+
+        fsync: bool
+            Sync the file after every write
+    """
+
+    def __init__(self, path=JOURNAL_PATH, fsync=JOURNAL_FSYNC):
+        self.path = path
+        self.fsync = fsync
+
+        self._fd = None
+        self._pid = None
+        self._lock = Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    def _open(self):
+        # A new journal is written aside and linked in place with its
+        # header, other workers never see it without one
+        if not os.path.exists(self.path):
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+
+            with open(tmp, "wb") as f:
+                f.write(HEADER.pack(MAGIC, VERSION, RECORD.size))
+
+            try:
+                os.link(tmp, self.path)
+
+            except FileExistsError:
+                pass
+
+            finally:
+                os.unlink(tmp)
+
+        return os.open(self.path, os.O_WRONLY | os.O_APPEND)
+
+    def append_many(self, votes):
+        """
+        Journals votes, with keys "win", "los", "user" and "created".
+
+        Failures are logged and not raised, the vote still goes to the db.
+        """
+
+        if not self.enabled or not votes:
+            return
+
+        data = b"".join(pack(vote) for vote in votes)
+
+        try:
+            with self._lock:
+                if self._fd is None or self._pid != os.getpid():
+                    self._fd, self._pid = self._open(), os.getpid()
+
+                os.write(self._fd, data)
+
+                if self.fsync:
+                    os.fsync(self._fd)
+
+        except Exception as e:
+            log.error(f"Could not journal {len(votes)} votes: {e}")
+
+    def append(self, vote):
+        self.append_many([vote])
+
+
+def read(path):
+    """
+    Maps a journal as a read-only NumPy structured array (DTYPE), without
+    copying it.
+
+    Raises
+    ------
+        ValueError
+            If the file is not a journal
+    """
+
+    with open(path, "rb") as f:
+        magic, version, size = HEADER.unpack(f.read(HEADER.size))
+
+    if magic != MAGIC or size != RECORD.size:
+        raise ValueError(f"{path} is not a votes journal (version {VERSION})")
+
+    n = (os.path.getsize(path) - HEADER.size) // RECORD.size
+
+    if n == 0:
+        return np.zeros(0, dtype=DTYPE)
+
+    return np.memmap(path, dtype=DTYPE, mode="r", offset=HEADER.size, shape=(n,))
+
+
+def to_index(column, ids):
+    """
+    Indices in `ids` of the ObjectId bytes of a journal column, -1 for
+    the ones not in `ids`.
+    """
+
+    if not ids:
+        return np.full(len(column), -1, dtype=np.int64)
+
+    keys = np.array([_id.binary for _id in ids], dtype="S12")
+    order = np.argsort(keys)
+    keys = keys[order]
+
+    pos = np.minimum(np.searchsorted(keys, column), len(keys) - 1)
+
+    return np.where(keys[pos] == column, order[pos], -1)
+
+
+def load_votes(path, ids):
+    """
+    Like `replay.load_votes`, from a journal: the winner and loser
+    indices in `ids` of every vote, in `created` order. Votes on unknown
+    content, or on the same content twice, are skipped.
+    """
+
+    records = read(path)
+    order = np.argsort(records["created"], kind="stable")
+
+    win, los = to_index(records["win"][order], ids), to_index(records["los"][order], ids)
+    keep = (win >= 0) & (los >= 0) & (win != los)
+
+    return win[keep], los[keep]
+
+
+def recover(db, path, since):
+    """
+    Applies the journaled votes missing in `db.votes`, e.g. votes queued
+    by VOTE_BUFFER when the process died.
+
+    Parameters
+    ----------
+        since: datetime
+            Only votes created from then on are checked
+
+    Returns
+    -------
+        int
+            Number of votes applied
+    """
+
+    from db_utils import db_vote_many
+
+    records = read(path)
+    since_ms = (since - EPOCH) // MS
+    records = records[records["created"] >= since_ms]
+
+    stored = {
+        (v["user"], v["win"], v["los"], (v["created"] - EPOCH) // MS)
+        for v in db.votes.find({"created": {"$gte": since}}, {"_id": 0})
+    }
+
+    missing = []
+
+    for r in records[np.argsort(records["created"], kind="stable")]:
+        vote = (_oid(r["user"]), _oid(r["win"]), _oid(r["los"]), int(r["created"]))
+
+        if vote not in stored:
+            missing.append({
+                "user": vote[0],
+                "win": vote[1],
+                "los": vote[2],
+                "created": EPOCH + timedelta(milliseconds=vote[3])
+            })
+
+    if not missing:
+        return 0
+
+    applied, _ = db_vote_many(missing)
+    return len(applied)
+
+
+journal = Journal()
+
+
+if __name__ == "__main__":
+    from database import db
+
+    parser = ArgumentParser(description="Inspect a votes journal, or apply the votes missing in the db.")
+    parser.add_argument("path", nargs="?", default=JOURNAL_PATH)
+    parser.add_argument("--recover", action="store_true", help="Apply the votes missing in the db")
+    parser.add_argument("--hours", type=float, default=24, help="Votes of the last hours to recover")
+    args = parser.parse_args()
+
+    t = time()
+    records = read(args.path)
+    print(f"{len(records)} votes journaled: {time() - t:2.6} s.")
+
+    if len(records):
+        first, last = records["created"].min(), records["created"].max()
+        print(f"From {EPOCH + timedelta(milliseconds=int(first))} to {EPOCH + timedelta(milliseconds=int(last))}.")
+
+    if args.recover:
+        t = time()
+        applied = recover(db, args.path, datetime.now() - timedelta(hours=args.hours))
+        print(f"{applied} missing votes applied: {time() - t:2.6} s.")
@@ -0,0 +1,251 @@
+from bisect import bisect_left, bisect_right, insort
+from threading import RLock
+from time import monotonic
+
+from config import LEADERBOARD_TTL
+
+
+class Leaderboard:
+    """
+    In-memory ranking of content by ELO.
+
+    Content is kept in a sorted array of `(-elo, _id)` keys, so the order
+    matches `sort("votes.elo", -1)` with ties broken by id. Positions are
+    found by bisection, and rating changes are applied incrementally by
+    moving one key.
+
+    The board is rebuilt from the db every `ttl` seconds (0 disables it),
+    to pick up writes from other processes. It ranks the content matching
+    `query`, all of it by default.
+    """
+
+    def __init__(self, ttl=LEADERBOARD_TTL, query=None):
+        self.ttl = ttl
+        self.query = query or {}
+        self.keys = []
+        self.docs = {}
+        self.loaded = None
+
+        self._lock = RLock()
+
+    @staticmethod
+    def key(doc):
+        return (-doc["votes"]["elo"], doc["_id"])
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, _id):
+        return _id in self.docs
+
+    def load(self, content):
+        """
+        Builds the board.
+
+        Parameters
+        ----------
+            content: iterable
+                All the content documents (a cursor works)
+        """
+
+        docs = {c["_id"]: c for c in content}
+        keys = sorted(self.key(c) for c in docs.values())
+
+        with self._lock:
+            self.docs, self.keys = docs, keys
+            self.loaded = monotonic()
+
+    def stale(self):
+        if self.loaded is None:
+            return True
+
+        return self.ttl > 0 and monotonic() - self.loaded > self.ttl
+
+    def ensure(self, db):
+        """Loads the board from `db.content` if it is not loaded or stale."""
+
+        if self.stale():
+            self.load(db.content.find(self.query))
+
+    def update(self, doc):
+        """Adds a content, or moves it to its new rating."""
+
+        with self._lock:
+            old = self.docs.get(doc["_id"])
+
+            if old is not None:
+                i = bisect_left(self.keys, self.key(old))
+                del self.keys[i]
+
+            self.docs[doc["_id"]] = doc
+            insort(self.keys, self.key(doc))
+
+    def update_many(self, docs):
+        if self.loaded is None:
+            return
+
+        for doc in docs:
+            if doc is not None and all(doc.get(k) == v for k, v in self.query.items()):
+                self.update(doc)
+
+    def remove(self, _id):
+        with self._lock:
+            doc = self.docs.pop(_id, None)
+
+            if doc is not None:
+                del self.keys[bisect_left(self.keys, self.key(doc))]
+
+    def position(self, _id):
+        """
+        Returns the 1-based position of a content, None if not ranked.
+        """
+
+        with self._lock:
+            doc = self.docs.get(_id)
+
+            if doc is None:
+                return None
+
+            return bisect_left(self.keys, self.key(doc)) + 1
+
+    def around(self, _id, n):
+        """
+        Returns the position of a content and its neighbors.
+
+        Parameters
+        ----------
+            _id: ObjectId
+                Id of the content
+
+            n: int
+                Neighbors on each side
+
+        Returns
+        -------
+            int, list
+                1-based position, and `top` tuples from `n` positions
+                above to `n` below. None, None if the content is not
+                ranked.
+        """
+
+        with self._lock:
+            position = self.position(_id)
+
+            if position is None:
+                return None, None
+
+            offset = max(0, position - 1 - n)
+            return position, self.top(position + n - offset, offset)
+
+    def top(self, limit=None, offset=0):
+        """
+        Returns a slice of the ranking.
+
+        Parameters
+        ----------
+            limit: int
+                Max number of entries, all of them if None
+
+            offset: int
+                Entries to skip from the top
+
+        Returns
+        -------
+            list
+                (position, content) tuples, ordered desc.
+        """
+
+        end = None if limit is None else offset + limit
+
+        with self._lock:
+            keys = self.keys[offset:end]
+            return [(offset + i + 1, self.docs[k[1]]) for i, k in enumerate(keys)]
+
+    def page(self, limit, after=None):
+        """
+        Returns a page of the ranking, keyset paginated.
+
+        Parameters
+        ----------
+            limit: int
+                Max number of entries
+
+            after: tuple
+                (elo, _id) of the last entry of the previous page
+
+        Returns
+        -------
+            list
+                (position, content) tuples, ordered desc.
+        """
+
+        with self._lock:
+            offset = 0
+
+            if after is not None:
+                offset = bisect_right(self.keys, (-after[0], after[1]))
+
+            return self.top(limit, offset)
+
+    def iter(self, chunk=1000):
+        """Iterates the whole ranking as `top` tuples, `chunk` at a time."""
+
+        offset = 0
+
+        while True:
+            entries = self.top(chunk, offset)
+            yield from entries
+
+            if len(entries) < chunk:
+                return
+
+            offset += chunk
+
+
+class ContestLeaderboards:
+    """Leaderboards of each contest, created on first use."""
+
+    def __init__(self, ttl=LEADERBOARD_TTL):
+        self.ttl = ttl
+        self.boards = {}
+
+        self._lock = RLock()
+
+    def get(self, db, contest_id):
+        """
+        Returns the (ensured) leaderboard of a contest.
+
+        Returns
+        -------
+            Leaderboard
+                None if the contest does not exist
+        """
+
+        with self._lock:
+            board = self.boards.get(contest_id)
+
+        if board is None:
+            if db.contest.count_documents({"_id": contest_id}, limit=1) == 0:
+                return None
+
+            with self._lock:
+                board = self.boards.setdefault(
+                    contest_id, Leaderboard(self.ttl, {"contest_id": contest_id}))
+
+        board.ensure(db)
+        return board
+
+    def update_many(self, docs):
+        for doc in docs:
+            board = None if doc is None else self.boards.get(doc.get("contest_id"))
+
+            if board is not None:
+                board.update_many([doc])
+
+    def remove(self, contest_id):
+        with self._lock:
+            self.boards.pop(contest_id, None)
+
+
+leaderboard = Leaderboard()
+contest_leaderboards = ContestLeaderboards()
@@ -0,0 +1,206 @@
+import random
+
+from threading import RLock
+from time import monotonic
+
+from config import MATCH_BAND, MATCH_SPREAD, MATCH_TRIES, MATCH_TTL
+
+
+class Bucket:
+    """Set of ids with O(1) add, remove and random choice."""
+
+    def __init__(self):
+        self.items = []
+        self.index = {}
+
+    def __len__(self):
+        return len(self.items)
+
+    def add(self, item):
+        if item not in self.index:
+            self.index[item] = len(self.items)
+            self.items.append(item)
+
+    def remove(self, item):
+        i = self.index.pop(item, None)
+
+        if i is None:
+            return
+
+        last = self.items.pop()
+
+        if i < len(self.items):
+            self.items[i] = last
+            self.index[last] = i
+
+    def choice(self):
+        return random.choice(self.items)
+
+
+class MatchPool:
+    """
+    In-memory pool of content to build the users stacks.
+
+    Content is bucketed twice: by ELO band (`band` points wide) and by
+    vote count tier (log2 of the votes). The first content of a pair is
+    drawn from a tier chosen with weight size / 2**tier, which favors
+    under-voted content. Its opponent is drawn from the same ELO band, or
+    the closest ones up to `spread` bands away.
+
+    Like the leaderboard, the pool is rebuilt every `ttl` seconds.
+    """
+
+    def __init__(self, band=MATCH_BAND, spread=MATCH_SPREAD, tries=MATCH_TRIES, ttl=MATCH_TTL):
+        self.band = band
+        self.spread = spread
+        self.tries = tries
+        self.ttl = ttl
+
+        self.docs = {}
+        self.bands = {}
+        self.tiers = {}
+        self.loaded = None
+
+        self._lock = RLock()
+
+    def __len__(self):
+        return len(self.docs)
+
+    def _keys(self, doc):
+        band = int(doc["votes"]["elo"] // self.band)
+        tier = (doc["votes"]["total"] + 1).bit_length() - 1
+        return band, tier
+
+    def _add(self, doc):
+        band, tier = self._keys(doc)
+
+        self.docs[doc["_id"]] = doc
+        self.bands.setdefault(band, Bucket()).add(doc["_id"])
+        self.tiers.setdefault(tier, Bucket()).add(doc["_id"])
+
+    def _remove(self, _id):
+        doc = self.docs.pop(_id, None)
+
+        if doc is None:
+            return
+
+        band, tier = self._keys(doc)
+
+        for buckets, key in ((self.bands, band), (self.tiers, tier)):
+            buckets[key].remove(_id)
+
+            if not buckets[key]:
+                del buckets[key]
+
+    def load(self, content):
+        """Builds the pool from all the content documents."""
+
+        with self._lock:
+            self.docs, self.bands, self.tiers = {}, {}, {}
+
+            for doc in content:
+                self._add(doc)
+
+            self.loaded = monotonic()
+
+    def stale(self):
+        if self.loaded is None:
+            return True
+
+        return self.ttl > 0 and monotonic() - self.loaded > self.ttl
+
+    def ensure(self, db):
+        """Loads the pool from `db.content` if it is not loaded or stale."""
+
+        if self.stale():
+            self.load(db.content.find())
+
+    def update(self, doc):
+        with self._lock:
+            self._remove(doc["_id"])
+            self._add(doc)
+
+    def update_many(self, docs):
+        if self.loaded is None:
+            return
+
+        for doc in docs:
+            if doc is not None:
+                self.update(doc)
+
+    def remove(self, _id):
+        with self._lock:
+            self._remove(_id)
+
+    def _first(self, user_id):
+        tiers = list(self.tiers)
+        weights = [len(self.tiers[t]) / 2**t for t in tiers]
+
+        for _ in range(self.tries):
+            tier = random.choices(tiers, weights=weights)[0]
+            doc = self.docs[self.tiers[tier].choice()]
+
+            if doc["user_id"] != user_id:
+                return doc
+
+        return None
+
+    def _opponent(self, first, user_id, accept):
+        band, _ = self._keys(first)
+
+        for d in range(self.spread + 1):
+            for b in {band - d, band + d}:
+                bucket = self.bands.get(b)
+
+                if not bucket:
+                    continue
+
+                for _ in range(self.tries):
+                    doc = self.docs[bucket.choice()]
+
+                    if doc["_id"] == first["_id"] or doc["user_id"] == user_id:
+                        continue
+
+                    if accept is None or accept(first, doc):
+                        return doc
+
+        return None
+
+    def pair(self, user_id, accept=None):
+        """
+        Draws a pair of content to vote.
+
+        Parameters
+        ----------
+            user_id: ObjectId
+                The voter, whose own content is never drawn
+
+            accept: function, optional
+                Called with both contents, the pair is drawn again if it
+                returns False
+
+        Returns
+        -------
+            list
+                The two contents, None if no pair was found
+        """
+
+        with self._lock:
+            if len(self.docs) < 2:
+                return None
+
+            for _ in range(self.tries):
+                first = self._first(user_id)
+
+                if first is None:
+                    return None
+
+                second = self._opponent(first, user_id, accept)
+
+                if second is not None:
+                    return [first, second]
+
+        return None
+
+
+match_pool = MatchPool()
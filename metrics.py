@@ -0,0 +1,257 @@
+from bisect import bisect_left
+from threading import Lock
+from time import perf_counter
+
+from flask import g, request
+from pymongo import monitoring
+
+from hashing import hasher
+from ingest import vote_buffer
+
+
+# Latency buckets, in seconds
+BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+
+    pairs = ",".join(f'{n}="{v}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+
+        self._values = {}
+        self._lock = Lock()
+
+    def header(self):
+        return [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, value=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + value
+
+    def render(self):
+        with self._lock:
+            values = list(self._values.items())
+
+        return self.header() + [
+            f"{self.name}{_labels(self.labels, l)} {v}" for l, v in values]
+
+
+class Gauge(Metric):
+    """Gauge set by hand, or read from `function` on every scrape."""
+
+    kind = "gauge"
+
+    def __init__(self, name, description, labels=(), function=None):
+        super().__init__(name, description, labels)
+        self.function = function
+
+        if not labels:
+            self._values[()] = 0
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+    def inc(self, *labels, value=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + value
+
+    def render(self):
+        if self.function is not None:
+            self.set(self.function())
+
+        with self._lock:
+            values = list(self._values.items())
+
+        return self.header() + [
+            f"{self.name}{_labels(self.labels, l)} {v}" for l, v in values]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, description, labels=(), buckets=BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = buckets
+
+    def observe(self, value, *labels):
+        i = bisect_left(self.buckets, value)
+
+        with self._lock:
+            counts = self._values.get(labels)
+
+            if counts is None:
+                # Per bucket counts (+Inf last), sum
+                counts = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.]
+
+            counts[0][i] += 1
+            counts[1] += value
+
+    def render(self):
+        with self._lock:
+            values = [(l, list(c[0]), c[1]) for l, c in self._values.items()]
+
+        lines = self.header()
+        names = self.labels + ("le",)
+
+        for labels, counts, total in values:
+            cumulative = 0
+
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(names, labels + (bound,))} {cumulative}")
+
+            lines.append(f"{self.name}_sum{_labels(self.labels, labels)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labels, labels)} {cumulative}")
+
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """All the metrics in Prometheus text format."""
+
+        lines = []
+
+        for metric in self.metrics:
+            lines += metric.render()
+
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_latency = registry.add(Histogram(
+    "http_request_seconds", "Request latency by route.", ("route", "method")))
+
+http_status = registry.add(Counter(
+    "http_responses_total", "Responses by route and status.", ("route", "method", "status")))
+
+mongo_latency = registry.add(Histogram(
+    "mongo_command_seconds", "Mongo command latency.", ("collection", "command")))
+
+mongo_failures = registry.add(Counter(
+    "mongo_command_failures_total", "Failed Mongo commands.", ("collection", "command")))
+
+pool_connections = registry.add(Gauge(
+    "mongo_pool_connections", "Open Mongo connections."))
+
+pool_checked_out = registry.add(Gauge(
+    "mongo_pool_checked_out", "Mongo connections in use."))
+
+hash_pending = registry.add(Gauge(
+    "hash_jobs_pending", "Password hashing jobs running or queued.",
+    function=lambda: hasher.pending))
+
+vote_buffer_depth = registry.add(Gauge(
+    "vote_buffer_depth", "Votes waiting to be flushed.",
+    function=lambda: vote_buffer.depth))
+
+
+def _route():
+    return request.url_rule.rule if request.url_rule is not None else "unmatched"
+
+
+def init_app(app):
+    """Times every request of the app."""
+
+    @app.before_request
+    def start_timer():
+        g.metrics_start = perf_counter()
+
+    @app.after_request
+    def observe(response):
+        start = g.pop("metrics_start", None)
+
+        if start is not None:
+            route = _route()
+            http_latency.observe(perf_counter() - start, route, request.method)
+            http_status.inc(route, request.method, str(response.status_code))
+
+        return response
+
+
+class CommandListener(monitoring.CommandListener):
+    """Mongo command timings, by collection and command."""
+
+    def __init__(self):
+        self._collections = {}
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+
+        if not isinstance(collection, str):
+            collection = ""
+
+        self._collections[(event.request_id, event.connection_id)] = collection
+
+    def _collection(self, event):
+        return self._collections.pop((event.request_id, event.connection_id), "")
+
+    def succeeded(self, event):
+        mongo_latency.observe(
+            event.duration_micros / 1e6, self._collection(event), event.command_name)
+
+    def failed(self, event):
+        collection = self._collection(event)
+        mongo_latency.observe(event.duration_micros / 1e6, collection, event.command_name)
+        mongo_failures.inc(collection, event.command_name)
+
+
+class PoolListener(monitoring.ConnectionPoolListener):
+    """Mongo connection pool usage."""
+
+    def pool_created(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        pool_connections.inc()
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pool_connections.inc(value=-1)
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        pass
+
+    def connection_checked_out(self, event):
+        pool_checked_out.inc()
+
+    def connection_checked_in(self, event):
+        pool_checked_out.inc(value=-1)
+
+
+listeners = [CommandListener(), PoolListener()]
@@ -1,7 +1,86 @@
 from functools import wraps
-from flask import g, request, redirect, url_for
+from hashlib import sha256
+from math import ceil
+from time import time
+from zlib import crc32
 
+from flask import g, make_response, request, redirect, url_for
+
+from cache import TTLCache
+from config import ADMIN_USERS, TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL
+from ratelimit import limiter
 from utils import error, decode
+from versions import versions
+
+token_cache = TTLCache(TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL)
+
+
+def decode_token(token):
+    """
+    Decodes a JWT, caching the result by token hash.
+
+    Tokens are cached up to TOKEN_CACHE_TTL seconds, never past their
+    "exp" claim.
+    """
+
+    key = sha256(token.encode()).digest()
+    data = token_cache.get(key)
+
+    if data is not None:
+        return data
+
+    data = decode(token)
+
+    if data is None:
+        return None
+
+    ttl = token_cache.ttl
+
+    if "exp" in data:
+        ttl = min(ttl, data["exp"] - time())
+
+    if ttl > 0:
+        token_cache.set(key, data, ttl)
+
+    return data
+
+
+def rate_limit(key):
+    """
+    Checks the rate limit of the current endpoint for `key`.
+
+    Returns
+    -------
+        None
+            If allowed
+
+        429
+            If over the limit, with Retry-After
+    """
+
+    wait = limiter.hit(request.endpoint, key)
+
+    if wait:
+        return error(message="Too many requests", code=429,
+                     headers={"Retry-After": str(ceil(wait))})
+
+    return None
+
+
+def limited(f):
+    """Rate limits an open endpoint by client IP. `auth` limits by user."""
+
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        limit = rate_limit(request.remote_addr)
+
+        if limit is not None:
+            return limit
+
+        return f(*args, **kwargs)
+
+    return decorated_function
+
 
 def auth(f):
     @wraps(f)
@@ -14,8 +93,93 @@ def auth(f):
         if "Bearer" in request.headers["AUTHORIZATION"]:
             token = token.split()[1] 
         
-        request.jwt_data = decode(token)
+        request.jwt_data = decode_token(token)
+
+        if request.jwt_data is None:
+            return error(message="Invalid token", code=401)
+
+        limit = rate_limit(request.jwt_data.get("user_id", request.remote_addr))
+
+        if limit is not None:
+            return limit
 
         return f(*args, **kwargs)
 
-    return decorated_function
\ No newline at end of file
+    return decorated_function
+
+
+def admin(f):
+    """Only lets ADMIN_USERS in. Goes after `auth`."""
+
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if request.jwt_data.get("user_id") not in ADMIN_USERS:
+            return error(message="Not allowed", code=403)
+
+        return f(*args, **kwargs)
+
+    return decorated_function
+
+
+def etag(name, period=0, state=None):
+    """
+    Conditional GET from a version counter (see versions.py).
+
+    The ETag is made of the version of `name`, the query string and, if
+    `period` is given, the current `period` seconds slot. A request with
+    a matching If-None-Match gets a 304 before the endpoint runs.
+
+    Endpoints that answer from a cache of the process (a leaderboard, the
+    current contest) give its `state` too, e.g. when it was loaded: the
+    counter is shared by all the workers, the caches are not, so a stale
+    worker must not give out, or match, the tag of a fresh one.
+
+    Parameters
+    ----------
+        name: str or callable
+            Counter name, or a function of the path parameters giving it
+
+        period: int
+            Seconds after which the ETag changes anyway (0 = never)
+
+        state: callable, optional
+            Function of the path parameters that brings the cache up to
+            date and returns its state
+    """
+
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            key = name(**kwargs) if callable(name) else name
+            version, modified = versions.get(key)
+
+            tag = f"{key}-{version}"
+
+            if state is not None:
+                tag += f"-{crc32(repr(state(**kwargs)).encode()):x}"
+
+            if period:
+                tag += f"-{int(time() // period)}"
+
+            if request.query_string:
+                tag += f"-{crc32(request.query_string):x}"
+
+            if request.if_none_match.contains(tag):
+                response = make_response("", 304)
+
+            else:
+                response = make_response(f(*args, **kwargs))
+
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(tag)
+
+            if modified is not None:
+                response.last_modified = modified
+
+            return response
+
+        return decorated_function
+
+    return decorator
@@ -0,0 +1,78 @@
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+
+from config import RATE_LIMITS, RATE_LIMIT_SIZE, RATE_LIMIT_STRIPES
+
+
+class RateLimiter:
+    """
+    Token buckets by key, spread over `stripes` locks.
+
+    Every stripe holds at most `size / stripes` buckets, evicting the
+    least recently used one, so memory is bounded whatever the number of
+    clients. An evicted bucket starts over full.
+
+    Parameters
+    ----------
+        limits: dict
+            (rate, burst) by endpoint: tokens refilled per second, and
+            bucket size
+    """
+
+    def __init__(self, limits=RATE_LIMITS, size=RATE_LIMIT_SIZE, stripes=RATE_LIMIT_STRIPES):
+        self.limits = limits
+        self.per_stripe = max(1, size // stripes)
+
+        self._buckets = [OrderedDict() for _ in range(stripes)]
+        self._locks = [Lock() for _ in range(stripes)]
+
+    def hit(self, endpoint, key):
+        """
+        Takes a token from the bucket of `key` on `endpoint`.
+
+        Returns
+        -------
+            float
+                0 if allowed, else seconds before a token is available
+        """
+
+        limit = self.limits.get(endpoint)
+
+        if limit is None:
+            return 0.
+
+        rate, burst = limit
+        key = (endpoint, key)
+        stripe = hash(key) % len(self._locks)
+        buckets = self._buckets[stripe]
+        now = monotonic()
+
+        with self._locks[stripe]:
+            bucket = buckets.get(key)
+
+            if bucket is None:
+                # [tokens, last refill]
+                bucket = buckets[key] = [burst, now]
+
+                if len(buckets) > self.per_stripe:
+                    buckets.popitem(last=False)
+
+            else:
+                buckets.move_to_end(key)
+                bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return 0.
+
+            return (1 - bucket[0]) / rate
+
+    def clear(self):
+        for lock, buckets in zip(self._locks, self._buckets):
+            with lock:
+                buckets.clear()
+
+
+limiter = RateLimiter()
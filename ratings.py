@@ -0,0 +1,281 @@
+from argparse import ArgumentParser
+from datetime import datetime
+from time import time
+
+import numpy as np
+
+from pymongo import UpdateOne
+
+from cache import TTLCache
+from config import LOGGER as log
+from config import CONTEST_TTL, GLICKO_TAU, GLICKO_RD, GLICKO_VOL
+from database import db
+from elo import R0, update_elo
+
+
+# Glicko-2 scale factor, between ratings and their internal scale
+SCALE = 173.7178
+
+
+class Engine:
+    """
+    Rating engine of a contest.
+
+    `update` gives the per vote queries, like `elo.update_elo`. Engines
+    rated by period only count the votes there, and rate them in
+    `rate_period`.
+    """
+
+    name = None
+
+    def update(self, win, los):
+        """(filter, update) queries for winner and loser, see `elo.update_elo`."""
+        raise NotImplementedError
+
+    def rate_period(self, db, contest, end):
+        """Rates the votes of `contest` up to `end`. Returns the votes rated."""
+        return 0
+
+
+class Elo(Engine):
+    """The ELO of elo.py, one vote at a time."""
+
+    name = "elo"
+
+    def update(self, win, los):
+        return update_elo(win, los)
+
+
+def _counters(win, los):
+    """Like `update_elo`, without the rating."""
+
+    return tuple(
+        ({"_id": c["_id"], "votes.total": c["votes"]["total"]},
+         {"$inc": {"votes.total": 1, key: 1}})
+        for c, key in ((win, "votes.up"), (los, "votes.down")))
+
+
+class Glicko2(Engine):
+    """
+    Glicko-2, rated by period.
+
+    Votes only count up / down, and `rate_period` rates all the votes of
+    a period at once, vectorized over contents. The rating (in the usual
+    1500 scale) goes to `votes.elo`, so rankings work the same, with the
+    rating deviation and volatility in `votes.rd` and `votes.vol`.
+
+    Parameters
+    ----------
+        tau: float
+            System constant, how much volatility can change
+
+        rd, vol: float
+            Rating deviation and volatility of new content
+    """
+
+    name = "glicko2"
+
+    def __init__(self, tau=GLICKO_TAU, rd=GLICKO_RD, vol=GLICKO_VOL, epsilon=1e-6):
+        self.tau = tau
+        self.rd = rd
+        self.vol = vol
+        self.epsilon = epsilon
+
+    def update(self, win, los):
+        return _counters(win, los)
+
+    def _volatility(self, sigma, phi, v, delta):
+        """New volatility of every content (step 5, Illinois algorithm)."""
+
+        tau2 = self.tau**2
+        a = np.log(sigma**2)
+
+        def f(x):
+            ex = np.exp(x)
+            return ex * (delta**2 - phi**2 - v - ex) / (2 * (phi**2 + v + ex)**2) - (x - a) / tau2
+
+        big = delta**2 > phi**2 + v
+        A = a.copy()
+        B = np.where(big, np.log(np.where(big, delta**2 - phi**2 - v, 1)), a - self.tau)
+
+        low = ~big & (f(B) < 0)
+
+        while low.any():
+            B[low] -= self.tau
+            low &= f(B) < 0
+
+        fA, fB = f(A), f(B)
+        todo = np.abs(B - A) > self.epsilon
+
+        for _ in range(100):
+            if not todo.any():
+                break
+
+            C = A + (A - B) * fA / np.where(todo, fB - fA, 1)
+            fC = f(C)
+
+            swap = todo & (fC * fB <= 0)
+            A, fA = np.where(swap, B, A), np.where(swap, fB, np.where(todo, fA / 2, fA))
+            B, fB = np.where(todo, C, B), np.where(todo, fC, fB)
+
+            todo &= np.abs(B - A) > self.epsilon
+
+        return np.exp(A / 2)
+
+    def rate(self, rating, rd, vol, player, opponent, score):
+        """
+        Rates one period.
+
+        Parameters
+        ----------
+            rating, rd, vol: ndarray
+                Ratings, deviations and volatilities by content index
+
+            player, opponent, score: ndarray
+                Games of the period, one row per side of each vote: the
+                content, its opponent and 1 or 0
+
+        Returns
+        -------
+            ndarray, ndarray, ndarray
+                New ratings, deviations and volatilities
+        """
+
+        n = len(rating)
+        mu, phi = (rating - R0) / SCALE, rd / SCALE
+
+        g = 1 / np.sqrt(1 + 3 * phi[opponent]**2 / np.pi**2)
+        e = 1 / (1 + np.exp(-g * (mu[player] - mu[opponent])))
+
+        played = np.bincount(player, minlength=n) > 0
+        inv_v = np.bincount(player, g**2 * e * (1 - e), minlength=n)
+        v = np.where(played, 1 / np.where(played, inv_v, 1), np.inf)
+        delta_sum = np.bincount(player, g * (score - e), minlength=n)
+
+        sigma = vol.copy()
+        sigma[played] = self._volatility(
+            vol[played], phi[played], v[played], v[played] * delta_sum[played])
+
+        phi_star = np.sqrt(phi**2 + sigma**2)
+        phi_new = np.where(played, 1 / np.sqrt(1 / phi_star**2 + inv_v), phi_star)
+        mu_new = mu + phi_new**2 * delta_sum
+
+        return mu_new * SCALE + R0, phi_new * SCALE, sigma
+
+    def rate_period(self, db, contest, end, chunk=1000):
+        """
+        Rates the votes of the contest since the last period, up to `end`,
+        and writes all the contents of the contest in one bulk per
+        `chunk`. The end of the period is kept in `contest.rating_period`.
+        """
+
+        contents = list(db.content.find({"contest_id": contest["_id"]}, {"votes": 1}))
+        index = {c["_id"]: i for i, c in enumerate(contents)}
+
+        query = {"$lt": end}
+
+        if contest.get("rating_period") is not None:
+            query["$gte"] = contest["rating_period"]
+
+        win, los = [], []
+
+        for vote in db.votes.find({"created": query}, {"_id": 0, "win": 1, "los": 1}):
+            w, l = index.get(vote["win"]), index.get(vote["los"])
+
+            if w is not None and l is not None and w != l:
+                win.append(w)
+                los.append(l)
+
+        votes = [c["votes"] for c in contents]
+        rating = np.array([v.get("elo", R0) for v in votes], dtype=np.float64)
+        rd = np.array([v.get("rd", self.rd) for v in votes], dtype=np.float64)
+        vol = np.array([v.get("vol", self.vol) for v in votes], dtype=np.float64)
+
+        win, los = np.array(win, dtype=np.int64), np.array(los, dtype=np.int64)
+        player, opponent = np.concatenate((win, los)), np.concatenate((los, win))
+        score = np.concatenate((np.ones(len(win)), np.zeros(len(los))))
+
+        rating, rd, vol = self.rate(rating, rd, vol, player, opponent, score)
+
+        for a in range(0, len(contents), chunk):
+            db.content.bulk_write([
+                UpdateOne({"_id": contents[i]["_id"]}, {"$set": {
+                    "votes.elo": float(rating[i]),
+                    "votes.rd": float(rd[i]),
+                    "votes.vol": float(vol[i])
+                }})
+                for i in range(a, min(a + chunk, len(contents)))
+            ], ordered=False)
+
+        db.contest.update_one({"_id": contest["_id"]}, {"$set": {"rating_period": end}})
+
+        return len(win)
+
+
+ENGINES = {engine.name: engine for engine in (Elo(), Glicko2())}
+
+# Engine name of every contest
+_engines = TTLCache(1000, CONTEST_TTL)
+
+
+def engine_of(contest_id, source=None):
+    """
+    Engine of a contest, from its "rating" field. ELO by default.
+
+    Parameters
+    ----------
+        source: Database, optional
+            Database of the contest, the app one by default
+    """
+
+    if contest_id is None:
+        return ENGINES["elo"]
+
+    name = _engines.get(contest_id)
+
+    if name is None:
+        source = db if source is None else source
+        contest = source.contest.find_one({"_id": contest_id}, {"rating": 1}) or {}
+        name = contest.get("rating", "elo")
+        _engines.set(contest_id, name)
+
+    engine = ENGINES.get(name)
+
+    if engine is None:
+        log.warning(f"Unknown rating engine {name} of contest {contest_id}, using ELO")
+        return ENGINES["elo"]
+
+    return engine
+
+
+def update_rating(win, los):
+    """`update_elo`, or the update of the engine of the winner's contest."""
+    return engine_of(win.get("contest_id")).update(win, los)
+
+
+def rate_periods(db, end=None):
+    """Closes the rating period of every contest rated by period."""
+
+    end = end or datetime.now()
+    rated = {}
+
+    for contest in db.contest.find({"rating": {"$in": list(ENGINES)}}):
+        rated[contest["_id"]] = ENGINES[contest["rating"]].rate_period(db, contest, end)
+
+    return rated
+
+
+if __name__ == "__main__":
+    from versions import versions
+
+    parser = ArgumentParser(description="Close the rating period of the contests rated by period.")
+    args = parser.parse_args()
+
+    t = time()
+    rated = rate_periods(db)
+    versions.bump("ranking")
+
+    for contest_id, votes in rated.items():
+        print(f"{contest_id}: {votes} votes rated.")
+
+    print(f"Rating time: {time() - t:2.6} s.")
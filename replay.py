@@ -0,0 +1,228 @@
+from argparse import ArgumentParser
+from array import array
+from datetime import datetime, timedelta
+from time import time
+
+import numpy as np
+
+from pymongo import UpdateOne
+
+from elo import K, R0
+from ratings import engine_of
+from scores import scored
+
+EPOCH = datetime(1970, 1, 1)
+MS = timedelta(milliseconds=1)
+
+
+def load_content(db, engine="elo", batch_size=10000):
+    """
+    Ids of the contents rated by `engine` (see ratings.py), in `content`
+    order. None for all of them.
+    """
+
+    ids = []
+
+    for c in db.content.find({}, {"_id": 1, "contest_id": 1}, batch_size=batch_size):
+        if engine is None or engine_of(c.get("contest_id"), db).name == engine:
+            ids.append(c["_id"])
+
+    return ids
+
+
+def load_votes(db, batch_size=10000, created=False, engine="elo"):
+    """
+    Streams the votes log in `created` order.
+
+    Content ids are mapped to dense indices, in `content` order. Only the
+    contents rated by `engine` are loaded (see `load_content`), so the
+    ratings of other engines are never replayed as ELO. Votes on other
+    content, content that does not exist anymore, or on the same content
+    twice, are skipped.
+
+    Parameters
+    ----------
+        created: bool
+            Also return the `created` time of each vote
+
+        engine: str
+            Rating engine of the contents, None for all of them
+
+    Returns
+    -------
+        list, ndarray, ndarray[, ndarray]
+            Content ids, winner and loser indices of each vote, and its
+            `created` time in ms since the epoch if asked.
+    """
+
+    ids = load_content(db, engine, batch_size)
+    index = {_id: i for i, _id in enumerate(ids)}
+
+    win, los, times = array("l"), array("l"), array("q")
+    fields = {"_id": 0, "win": 1, "los": 1}
+
+    if created:
+        fields["created"] = 1
+
+    cursor = db.votes.find({}, fields, batch_size=batch_size)
+
+    for vote in cursor.sort("created", 1):
+        w, l = index.get(vote["win"]), index.get(vote["los"])
+
+        if w is None or l is None or w == l:
+            continue
+
+        win.append(w)
+        los.append(l)
+
+        if created:
+            times.append((vote["created"] - EPOCH) // MS)
+
+    win, los = np.array(win, dtype=np.int64), np.array(los, dtype=np.int64)
+
+    if created:
+        return ids, win, los, np.array(times, dtype=np.int64)
+
+    return ids, win, los
+
+
+def levels(win, los, n):
+    """
+    Splits the votes in levels that can be rated at once.
+
+    A vote goes one level after the last one of any of its contents, so
+    every level touches each content at most once, and the votes of a
+    content keep their order. Rating level by level is then exactly the
+    same as rating the votes one by one.
+
+    Returns
+    -------
+        ndarray, ndarray
+            Vote indices ordered by level, and the level boundaries
+    """
+
+    last = [0] * n
+    level = []
+
+    for w, l in zip(win.tolist(), los.tolist()):
+        lvl = max(last[w], last[l]) + 1
+        last[w] = last[l] = lvl
+        level.append(lvl)
+
+    level = np.array(level, dtype=np.int64)
+    order = np.argsort(level, kind="stable")
+    bounds = np.flatnonzero(np.diff(level[order])) + 1
+
+    return order, np.concatenate(([0], bounds, [len(order)]))
+
+
+def replay(win, los, n, k=K, r0=R0, trace=False):
+    """
+    Rates a votes log from scratch, vectorized by level.
+
+    Same rating as `elo.update_elo`, with `K` and `R0` overridable.
+
+    Parameters
+    ----------
+        win, los: ndarray
+            Winner and loser indices of each vote, in order
+
+        n: int
+            Number of contents
+
+        trace: bool
+            Also return the ratings left by each vote
+
+    Returns
+    -------
+        dict
+            "elo", "total", "up" and "down" arrays by content index, and
+            with `trace` "win_elo" and "los_elo" arrays by vote index
+    """
+
+    elo = np.full(n, r0, dtype=np.float64)
+    up = np.zeros(n, dtype=np.int64)
+    down = np.zeros(n, dtype=np.int64)
+
+    if trace:
+        win_elo = np.empty(len(win), dtype=np.float64)
+        los_elo = np.empty(len(los), dtype=np.float64)
+
+    order, bounds = levels(win, los, n)
+
+    for a, b in zip(bounds[:-1], bounds[1:]):
+        votes = order[a:b]
+        w, l = win[votes], los[votes]
+
+        r_w, r_l = elo[w], elo[l]
+        c_w, c_l = up[w] + down[w] + 1, up[l] + down[l] + 1
+
+        e_w = 1. / (1. + 10**((r_l - r_w) / 400))
+        e_l = 1. / (1. + 10**((r_w - r_l) / 400))
+
+        elo[w] = r_w + (k + k / c_w) * (1 - e_w)
+        elo[l] = r_l + (k + k / c_l) * (0 - e_l)
+
+        up[w] += 1
+        down[l] += 1
+
+        if trace:
+            win_elo[votes] = elo[w]
+            los_elo[votes] = elo[l]
+
+    ratings = {"elo": elo, "total": up + down, "up": up, "down": down}
+
+    if trace:
+        ratings.update(win_elo=win_elo, los_elo=los_elo)
+
+    return ratings
+
+
+def write_ratings(db, ids, ratings, chunk=1000):
+    """Writes the ratings (and scores) back to `content`, `chunk` updates per bulk."""
+
+    for a in range(0, len(ids), chunk):
+        db.content.bulk_write([
+            UpdateOne({"_id": ids[i]}, scored({"$set": {
+                "votes.elo": float(ratings["elo"][i]),
+                "votes.total": int(ratings["total"][i]),
+                "votes.up": int(ratings["up"][i]),
+                "votes.down": int(ratings["down"][i])
+            }}))
+            for i in range(a, min(a + chunk, len(ids)))
+        ], ordered=False)
+
+
+if __name__ == "__main__":
+    from database import db
+
+    parser = ArgumentParser(description="Rebuild the ELO ratings from the votes log. "
+                                        "Contests rated by another engine are left as is.")
+    parser.add_argument("--k", type=float, default=K)
+    parser.add_argument("--r0", type=float, default=R0)
+    parser.add_argument("--chunk", type=int, default=1000)
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--journal", help="Read the votes from this journal instead of the db")
+    args = parser.parse_args()
+
+    t = time()
+
+    if args.journal:
+        import journal
+
+        ids = load_content(db)
+        win, los = journal.load_votes(args.journal, ids)
+
+    else:
+        ids, win, los = load_votes(db)
+
+    print(f"Loaded {len(win)} votes on {len(ids)} contents: {time() - t:2.6} s.")
+
+    t = time()
+    ratings = replay(win, los, len(ids), k=args.k, r0=args.r0)
+    print(f"Replay time: {time() - t:2.6} s.")
+
+    if not args.dry_run:
+        t = time()
+        write_ratings(db, ids, ratings, chunk=args.chunk)
+        print(f"Write time: {time() - t:2.6} s.")
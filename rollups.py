@@ -0,0 +1,205 @@
+from argparse import ArgumentParser
+from datetime import timedelta
+from time import time
+
+import numpy as np
+
+from pymongo import InsertOne, UpdateOne
+
+from config import LOGGER as log
+from ratings import engine_of
+from replay import EPOCH, load_votes, replay
+
+
+HOUR_MS = 3600 * 1000
+
+
+def hour(created):
+    """Start of the hour bucket of a time."""
+    return created.replace(minute=0, second=0, microsecond=0)
+
+
+def record(db, votes, contents):
+    """
+    Adds applied votes to the hourly rollups.
+
+    `rollups_content` gets the votes, wins and losses of each content per
+    hour, and its ELO after them. `rollups_contest` gets the votes of each
+    contest per hour. One upsert per bucket touched, in a single bulk per
+    collection.
+
+    Rollups can be rebuilt from the votes log (see `backfill`), so
+    failures are logged and not raised.
+
+    Parameters
+    ----------
+        votes: list
+            Vote documents, with keys "win", "los" and "created"
+
+        contents: dict
+            The updated contents by id. The ELO set on every bucket is the
+            one of these documents.
+    """
+
+    by_content, by_contest = {}, {}
+
+    for vote in votes:
+        h = hour(vote["created"])
+
+        for _id, won in ((vote["win"], 1), (vote["los"], 0)):
+            counts = by_content.setdefault((_id, h), [0, 0])
+            counts[0] += won
+            counts[1] += 1 - won
+
+        contest_id = (contents.get(vote["win"]) or {}).get("contest_id")
+
+        if contest_id is not None:
+            by_contest[(contest_id, h)] = by_contest.get((contest_id, h), 0) + 1
+
+    content_ops = []
+
+    for (_id, h), (wins, losses) in by_content.items():
+        doc = contents.get(_id)
+
+        if doc is None:
+            continue
+
+        content_ops.append(UpdateOne({"content_id": _id, "hour": h}, {
+            "$inc": {"votes": wins + losses, "wins": wins, "losses": losses},
+            "$set": {"contest_id": doc.get("contest_id"), "elo": doc["votes"]["elo"]}
+        }, upsert=True))
+
+    contest_ops = [
+        UpdateOne({"contest_id": _id, "hour": h}, {"$inc": {"votes": n}}, upsert=True)
+        for (_id, h), n in by_contest.items()
+    ]
+
+    try:
+        if content_ops:
+            db.rollups_content.bulk_write(content_ops, ordered=False)
+
+        if contest_ops:
+            db.rollups_contest.bulk_write(contest_ops, ordered=False)
+
+    except Exception as e:
+        log.error(f"Could not update rollups of {len(votes)} votes: {e}")
+
+
+def _groups(keys, then=()):
+    """
+    Sorts rows by `keys` then by `then` (first one primary), and finds the
+    groups of equal `keys`.
+
+    Returns
+    -------
+        ndarray, ndarray
+            Row order, and the start of every group in it
+    """
+
+    order = np.lexsort((tuple(keys) + tuple(then))[::-1])
+    change = np.zeros(len(order), dtype=bool)
+    change[:1] = True
+
+    for key in keys:
+        change[1:] |= key[order][1:] != key[order][:-1]
+
+    return order, np.flatnonzero(change)
+
+
+def _hour(h):
+    return EPOCH + timedelta(hours=int(h))
+
+
+def backfill(db, chunk=1000):
+    """
+    Rebuilds all the rollups from the votes log.
+
+    The ELO after every vote comes from a replay of the whole log (see
+    replay.py), so it is the rating `replay.py` would write. Contests
+    rated by another engine (see ratings.py) have no such history: their
+    buckets keep the counts, with a None "elo". Like the replay, run it
+    while no votes are recorded.
+
+    Returns
+    -------
+        int, int
+            Number of content and contest buckets written
+    """
+
+    ids, win, los, created = load_votes(db, created=True, engine=None)
+    ratings = replay(win, los, len(ids), trace=True)
+    hours = created // HOUR_MS
+    n = len(win)
+
+    contests = {c["_id"]: c.get("contest_id") for c in db.content.find({}, {"contest_id": 1})}
+    rated = np.array([engine_of(contests.get(_id), db).name == "elo" for _id in ids], dtype=bool)
+
+    # Content buckets, one row per side of each vote
+    content = np.concatenate((win, los))
+    hour_ = np.concatenate((hours, hours))
+    elo = np.concatenate((ratings["win_elo"], ratings["los_elo"]))
+    elo = np.where(rated[content], elo, np.nan)
+    won = np.concatenate((np.ones(n, dtype=np.int64), np.zeros(n, dtype=np.int64)))
+    seq = np.concatenate((np.arange(n), np.arange(n)))
+
+    # Last row of a bucket is its last vote
+    order, starts = _groups((content, hour_), then=(seq,))
+    ends = np.append(starts[1:], len(order))
+    wins = np.add.reduceat(won[order], starts) if n else starts
+
+    content_docs = [
+        {
+            "content_id": ids[c],
+            "hour": _hour(h),
+            "contest_id": contests.get(ids[c]),
+            "votes": int(b - a),
+            "wins": int(w),
+            "losses": int(b - a - w),
+            "elo": None if np.isnan(e) else float(e)
+        }
+        for c, h, a, b, w, e in zip(
+            content[order][starts].tolist(), hour_[order][starts].tolist(),
+            starts.tolist(), ends.tolist(),
+            wins.tolist(),
+            elo[order][ends - 1].tolist())
+    ]
+
+    # Contest buckets, by contest of the winner
+    contest_ids = sorted({c for c in contests.values() if c is not None})
+    contest_index = {c: i for i, c in enumerate(contest_ids)}
+    of_content = np.array([contest_index.get(contests.get(_id), -1) for _id in ids],
+                          dtype=np.int64)
+
+    contest = of_content[win]
+    keep = contest >= 0
+    contest, contest_hours = contest[keep], hours[keep]
+
+    order, starts = _groups((contest, contest_hours))
+    counts = np.diff(np.append(starts, len(order)))
+
+    contest_docs = [
+        {"contest_id": contest_ids[c], "hour": _hour(h), "votes": int(v)}
+        for c, h, v in zip(contest[order][starts].tolist(),
+                           contest_hours[order][starts].tolist(), counts.tolist())
+    ]
+
+    for collection, docs in ((db.rollups_content, content_docs),
+                             (db.rollups_contest, contest_docs)):
+        collection.delete_many({})
+
+        for a in range(0, len(docs), chunk):
+            collection.bulk_write([InsertOne(d) for d in docs[a:a + chunk]], ordered=False)
+
+    return len(content_docs), len(contest_docs)
+
+
+if __name__ == "__main__":
+    from database import db
+
+    parser = ArgumentParser(description="Rebuild the hourly vote rollups from the votes log.")
+    parser.add_argument("--chunk", type=int, default=1000)
+    args = parser.parse_args()
+
+    t = time()
+    contents, contests = backfill(db, chunk=args.chunk)
+    print(f"{contents} content and {contests} contest buckets written: {time() - t:2.6} s.")
@@ -1,35 +1,99 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 from dotenv import load_dotenv
+from queue import Full
 
 from flask_cors import CORS
-from flask import Flask, request
+from flask import Blueprint, Flask, request
 
-from passlib.hash import pbkdf2_sha256
-
-from pymongo import MongoClient, UpdateOne
-from bson.json_util import dumps
+from pymongo.errors import DuplicateKeyError
 from bson.objectid import ObjectId
 
-from elo import update_elo, R0
+from elo import R0
 
 from db_utils import *
 from utils import *
 
-from middleware import auth
+from middleware import auth, admin, etag, limited
+from ingest import vote_buffer
+from leaderboard import leaderboard, contest_leaderboards
+from matchmaking import match_pool
+from hashing import hasher, HashUnavailable
+from contest import contests
+from serializer import dumps, CONTENT, CONTEST, ROLLUP, USER
+from seen import seen
+from scores import SCORES, initial_scores, backfill as backfill_scores
+from indexes import bootstrap_indexes
+from rollups import hour, record
+from versions import versions
+from journal import journal
+from closeout import close_contest, is_closed, snapshot_around, snapshot_page
+from database import db, mongo
+
+import metrics
 
 from config import *
 
+# Cursor values: _id, or (number, _id) for the rankings
+ID_CURSOR = (ObjectId,)
+RANK_CURSOR = ((int, float), ObjectId)
+
 load_dotenv()
-db = None
 log = LOGGER
 
-app = Flask(__name__)
-cors = CORS(app)
+api = Blueprint("api", __name__)
+
+vote_listeners.append(leaderboard.update_many)
+vote_listeners.append(contest_leaderboards.update_many)
+vote_listeners.append(match_pool.update_many)
+vote_listeners.append(versions.bump_contents)
+
+
+def create_app(config=None):
+    """
+    Creates the app.
+
+    Safe to call before forking workers: the Mongo client is only created
+    on first use in each process (see database.py).
+
+    Parameters
+    ----------
+        config: dict, optional
+            Overrides of the app config, e.g. MONGO_* settings
+
+    Returns
+    -------
+        Flask
+            The app
+    """
+
+    app = Flask(__name__)
+    app.config.update(config or {})
+
+    CORS(app)
+
+    if app.config.get("METRICS", METRICS):
+        metrics.init_app(app)
+        mongo.options["event_listeners"] = metrics.listeners
+
+    mongo.init_app(app)
+    app.register_blueprint(api)
+
+    with app.app_context():
+        bootstrap_indexes(db)
+
+        # Content voted before scores existed, /ranking2 needs them
+        backfill_scores(db, missing=True)
+
+        leaderboard.load(db.content.find())
+        match_pool.load(db.content.find())
+
+    return app
 
 
 # Open endpoints
 
-@app.route("/register", methods=["post"])
+@api.route("/register", methods=["post"])
+@limited
 def register():
     """
     Register a user.
@@ -51,6 +115,12 @@ def register():
 
         403
             Username exists
+
+        429
+            Rate limited, with Retry-After
+
+        503
+            Too many requests
     """
 
     data = request.json
@@ -80,15 +150,20 @@ def register():
         description = data["description"]
     
     # username and email fields are unique 
-    # for all users
+    # for all users. Cheap indexed check before
+    # hashing, the unique indexes catch the races
 
-    target_1 = db.users.find_one({"username": data["username"]})
-    target_2 = db.users.find_one({"email": data["email"]})
+    target = db.users.find_one(
+        {"$or": [{"username": data["username"]}, {"email": data["email"]}]},
+        {"_id": 1})
 
-    if (target_1 is not None) or (target_2 is not None):
+    if target is not None:
         return error(message="User already exists", code=403)
 
-    hashed_pass = pbkdf2_sha256.hash(data["password"], rounds=10**6, salt_size=2**4)
+    try:
+        hashed_pass = hasher.hash(data["password"])
+    except HashUnavailable:
+        return error("Too many requests, try again later", 503, {"Retry-After": "1"})
 
     new_user = {
         "username": data["username"],
@@ -98,9 +173,15 @@ def register():
         "created": datetime.now()
     }
 
+    # username and email fields are unique 
+    # for all users (see indexes.py)
+
     try:
         user_id = db.users.insert_one(new_user).inserted_id
 
+    except DuplicateKeyError:
+        return error(message="User already exists", code=403)
+
     except Exception as e:
         log.error(e)
         return error("Could not register new user")
@@ -112,7 +193,8 @@ def register():
     return data, 200
 
 
-@app.route("/login", methods=["post"])
+@api.route("/login", methods=["post"])
+@limited
 def login():
     """
     Login a user.
@@ -132,6 +214,12 @@ def login():
 
         404
             User not found
+
+        429
+            Rate limited, with Retry-After
+
+        503
+            Too many requests
     """
 
     data = request.json
@@ -151,9 +239,20 @@ def login():
         return error(message="User not found", code=404) 
 
 
-    if not pbkdf2_sha256.verify(data["password"], target["password"]):
+    try:
+        valid, rehashed = hasher.verify(data["password"], target["password"])
+    except HashUnavailable:
+        return error("Too many requests, try again later", 503, {"Retry-After": "1"})
+
+    if not valid:
         return error("Could not log in")
 
+    if rehashed is not None:
+        db.users.update_one(
+            {"_id": target["_id"], "password": target["password"]},
+            {"$set": {"password": rehashed}})
+        invalidate_user(target["_id"])
+
     data = {
         "token": encode({"user_id": str(target["_id"])})
         }
@@ -161,7 +260,7 @@ def login():
     return data, 200
 
 
-@app.route("/user/<id>", methods=["get"])
+@api.route("/user/<id>", methods=["get"])
 def get_user(id):
     """
     Get a users data (profile).
@@ -184,10 +283,36 @@ def get_user(id):
     """
 
     user = db_get_user({"user_id": id})    
-    return dumps({"data": user}), 200
+    return dumps({"data": USER(user)}), 200
+
+
+def contest_state():
+    """ETag state of the current contest cache (see middleware.etag)."""
+
+    contests.current(db)
+    return contests.loaded
+
 
+def board_state(contest_id=None):
+    """ETag state of a leaderboard, the contest one if given."""
 
-@app.route("/contest", methods=["get"])
+    if contest_id is None:
+        leaderboard.ensure(db)
+        return leaderboard.loaded
+
+    try:
+        _id = ObjectId(contest_id)
+    except Exception:
+        return None
+
+    # Closed contests answer from their snapshot
+    board = None if is_closed(db, _id) else contest_leaderboards.get(db, _id)
+
+    return None if board is None else board.loaded
+
+
+@api.route("/contest", methods=["get"])
+@etag("contest", period=CONTEST_ETAG_PERIOD, state=contest_state)
 def get_contest():
     """
     Get current contest
@@ -196,49 +321,87 @@ def get_contest():
     -------
         200
             Current contest
+
+        304
+            If the ETag in If-None-Match is still current
+
+        404
+            If there is no current contest
     """
-    now = datetime.now()
 
     try:
-        # contest = db.contest.find_one({"start": {"$lte": now}, "end": {"$gt": now}})
-        contest = db.contest.find_one({"current": True})
+        contest = contests.current(db)
 
     except Exception as e:
         log.error(e)
         return error()
 
-    duration = contest["end"].timestamp() - contest["start"].timestamp()
-    now = datetime.now().timestamp() - contest["start"].timestamp()
-    contest["progress"] = now / duration
+    if contest is None:
+        return error(message="Contest not found", code=404)
+
+    contest = dict(contest, progress=contests.progress(contest))
 
-    return dumps({"data": contest})
+    return dumps({"data": CONTEST(contest)})
 
 
-@app.route("/content", methods=["get"])
+@api.route("/content", methods=["get"])
 def content_all():
     """
     Get all content.
 
+    Query parameters
+    ----------------
+        limit: int, optional
+            Page size.
+
+        cursor: str, optional
+            The "next" cursor of the previous page.
+
+        stream: bool, optional
+            Streams the whole list instead, ignores limit and cursor.
+
     Response codes
     --------------
         200
-            All content.
+            A page of content, and the cursor of the next one.
+
+        400
+            If the limit or cursor are not valid.
 
         500
             Could not get all content.
     """
 
+    if request.args.get("stream"):
+        return stream_json(db.content.find().sort("_id", 1), CONTENT)
+
+    try:
+        limit, cursor = page_args(request.args, ID_CURSOR)
+    except ValueError as e:
+        return error(message=str(e))
+
+    query = {}
+
+    if cursor is not None:
+        query["_id"] = {"$gt": cursor[0]}
+
     try:
-        content = db.content.find()
+        content = list(db.content.find(query).sort("_id", 1).limit(limit))
 
     except Exception as e:
         log.error(e)
         return error(message=str(e), code=500)
 
-    return dumps({"data": content}), 200
+    next = None
 
+    if len(content) == limit:
+        next = encode_cursor(content[-1]["_id"])
 
-@app.route("/content/<id>", methods=["get"])
+    return dumps({"data": CONTENT.many(content), "next": next}), 200
+
+
+@api.route("/content/<id>", methods=["get"])
+@etag(lambda id: f"content:{id}")
 def content_get(id):
     """
     Get a content by id.
@@ -253,6 +416,9 @@ def content_get(id):
         200
             The content.
 
+        304
+            If the ETag in If-None-Match is still current.
+
         400
             If the id is not valid.
 
@@ -267,12 +433,16 @@ def content_get(id):
 
     content = db.content.find_one({"_id": _id})
 
+    if content is None:
+        # Contents of closed contests
+        content = db.content_archive.find_one({"_id": _id})
+
     if content is None:
         return error("Content not found", 404)
 
-    return dumps({"data": content}), 200
+    return dumps({"data": CONTENT(content)}), 200
 
-@app.route("/content/contest/<id>", methods=["get"])
+@api.route("/content/contest/<id>", methods=["get"])
 def get_contest_content(id):
     """
     Get a content by contest id.
@@ -299,15 +469,16 @@ def get_contest_content(id):
     except Exception as e:
         return error(f"Raised exception: {e}", 400)
 
-    content = db.content.find_one({"contest_id": _id})
+    collection = db.content_archive if is_closed(db, _id) else db.content
+    content = collection.find_one({"contest_id": _id})
 
     if content is None:
         return error("Content not found", 404)
 
-    return dumps({"data": content}), 200
+    return dumps({"data": CONTENT(content)}), 200
 
 
-@app.route("/content/user/<id>", methods=["get"])
+@api.route("/content/user/<id>", methods=["get"])
 def get_user_content(id):
     """
     Get a users content.
@@ -317,103 +488,427 @@ def get_user_content(id):
         id: str
             The id of the user.
 
+    Query parameters
+    ----------------
+        limit: int, optional
+            Page size.
+
+        cursor: str, optional
+            The "next" cursor of the previous page.
+
     Response codes
     --------------
         200
-            The given users content.
+            A page of the given users content, live and archived, and the
+            cursor of the next one.
 
         400
-            If the id is not valid.
+            If the id, limit or cursor are not valid.
 
         404
             If the user is not found.
     """
 
+    try:
+        limit, cursor = page_args(request.args, ID_CURSOR)
+    except ValueError as e:
+        return error(message=str(e))
+
     user = db_get_user({"user_id": id})
 
-    _c = db.content.find({"user_id": user["_id"]})
-    
-    if _c is None:
-        return error("Content not found", 404)
+    query = {"user_id": user["_id"]}
 
-    return dumps({"data": _c}), 200
+    if cursor is not None:
+        query["_id"] = {"$gt": cursor[0]}
 
-@app.route("/ranking", methods=["get"])
+    # Live and archived contents (see closeout.py), one page of each
+    _c = []
+
+    for collection in (db.content, db.content_archive):
+        _c += collection.find(query).sort("_id", 1).limit(limit)
+
+    _c = sorted(_c, key=lambda c: c["_id"])[:limit]
+
+    next = None
+
+    if len(_c) == limit:
+        next = encode_cursor(_c[-1]["_id"])
+
+    return dumps({"data": CONTENT.many(_c), "next": next}), 200
+
+@api.route("/ranking", methods=["get"])
+@etag("ranking", state=board_state)
 def ranking():
     """
     Returns the ranking (ELO based)
 
+    Query parameters
+    ----------------
+        limit: int, optional
+            Page size.
+
+        cursor: str, optional
+            The "next" cursor of the previous page.
+
+        stream: bool, optional
+            Streams the whole list instead, ignores limit and cursor.
+
+    Response codes
+    --------------
+        200
+            A page of the ranking list, ordered desc, and the cursor of
+            the next one.
+
+        304
+            If the ETag in If-None-Match is still current.
+
+        400
+            If the limit or cursor are not valid.
+    """
+
+    leaderboard.ensure(db)
+
+    return ranking_page(leaderboard)
+
+
+@api.route("/ranking/<contest_id>", methods=["get"])
+@etag("ranking", state=board_state)
+def contest_ranking(contest_id):
+    """
+    Returns the ranking of a contest (ELO based)
+
+    Path parameters
+    ---------------
+        contest_id: str
+            The id of the contest.
+
+    Query parameters
+    ----------------
+        Same as /ranking.
+
+    Response codes
+    --------------
+        200
+            A page of the ranking list, ordered desc, and the cursor of
+            the next one.
+
+        304
+            If the ETag in If-None-Match is still current.
+
+        400
+            If the id, limit or cursor are not valid.
+
+        404
+            If the contest is not found.
+    """
+
+    try:
+        _id = ObjectId(contest_id)
+    except Exception as e:
+        return error(f"Raised exception: {e}", 400)
+
+    if is_closed(db, _id):
+        return snapshot_ranking(_id)
+
+    board = contest_leaderboards.get(db, _id)
+
+    if board is None:
+        return error("Contest not found", 404)
+
+    return ranking_page(board)
+
+
+@api.route("/ranking/<contest_id>/position/<content_id>", methods=["get"])
+def contest_position(contest_id, content_id):
+    """
+    Returns the position of a content in its contest ranking.
+
+    Path parameters
+    ---------------
+        contest_id: str
+            The id of the contest.
+
+        content_id: str
+            The id of the content.
+
+    Query parameters
+    ----------------
+        around: int, optional
+            Neighbors to return on each side, 2 by default.
+
     Response codes
     --------------
         200
-            Ranking list, ordered desc.
+            The position, the number of contents ranked and the
+            neighbors (the content included), ordered desc.
+
+        400
+            If any id or around are not valid.
+
+        404
+            If the contest or the content are not found.
     """
 
-    ranking = db.content.find().sort("votes.elo", -1)
+    try:
+        _id, _c = ObjectId(contest_id), ObjectId(content_id)
+        around = int(request.args.get("around", 2))
+    except Exception as e:
+        return error(f"Raised exception: {e}", 400)
+
+    if not 0 <= around <= 50:
+        return error("'around' should be between 0 and 50", 400)
+
+    if is_closed(db, _id):
+        position, neighbors, total = snapshot_around(db, _id, _c, around)
+
+    else:
+        board = contest_leaderboards.get(db, _id)
+
+        if board is None:
+            return error("Contest not found", 404)
+
+        position, neighbors = board.around(_c, around)
+        neighbors, total = [dict(r, position=pos) for pos, r in neighbors], len(board)
+
+    if position is None:
+        return error("Content not found", 404)
 
-    data, pos = [], 1
-    for r in ranking:
-        data.append(r)
-        data[pos-1]["position"] = pos
-        pos += 1     
+    data = {
+        "position": position,
+        "total": total,
+        "neighbors": CONTENT.many(neighbors)
+    }
 
     return dumps({"data": data}), 200
 
 
-@app.route("/ranking2", methods=["get"])
+def ranking_page(board):
+    """The /ranking response for a leaderboard, paginated or streamed."""
+
+    if request.args.get("stream"):
+        return stream_json((dict(r, position=pos) for pos, r in board.iter()), CONTENT)
+
+    try:
+        limit, cursor = page_args(request.args, RANK_CURSOR)
+    except ValueError as e:
+        return error(message=str(e))
+
+    data = [dict(r, position=pos) for pos, r in board.page(limit, cursor)]
+
+    next = None
+
+    if len(data) == limit:
+        next = encode_cursor(data[-1]["votes"]["elo"], data[-1]["_id"])
+
+    return dumps({"data": CONTENT.many(data), "next": next}), 200
+
+
+def snapshot_ranking(contest_id):
+    """
+    The /ranking/<contest_id> response of a closed contest, one snapshot
+    document per page (see closeout.py). `limit` is the snapshot page
+    size there.
+    """
+
+    if request.args.get("stream"):
+        pages = db.snapshots.find({"contest_id": contest_id}).sort("page", 1)
+        return stream_json((row for page in pages for row in page["rows"]), CONTENT)
+
+    try:
+        number = decode_cursor(request.args["cursor"])[0] if "cursor" in request.args else 0
+    except Exception as e:
+        return error(message=f"Invalid cursor: {e}")
+
+    if not isinstance(number, int) or isinstance(number, bool) or number < 0:
+        return error(message="Invalid 'cursor'")
+
+    page = snapshot_page(db, contest_id, number)
+
+    if page is None:
+        return dumps({"data": [], "next": None}), 200
+
+    next = None
+
+    if (number + 1) * page["size"] < page["total"]:
+        next = encode_cursor(number + 1)
+
+    return dumps({"data": CONTENT.many(page["rows"]), "next": next}), 200
+
+
+def activity(collection, key, id):
+    """Hourly rollups of `collection` where `key` is `id`, oldest first."""
+
+    try:
+        _id = ObjectId(id)
+    except Exception as e:
+        return error(f"Raised exception: {e}", 400)
+
+    hours = request.args.get("hours", ACTIVITY_HOURS, type=int)
+
+    if not 0 < hours <= ACTIVITY_MAX_HOURS:
+        return error(f"hours must be between 1 and {ACTIVITY_MAX_HOURS}", 400)
+
+    since = hour(datetime.now()) - timedelta(hours=hours - 1)
+    docs = collection.find({key: _id, "hour": {"$gte": since}}, {"_id": 0}).sort("hour", 1)
+
+    return dumps({"data": ROLLUP.many(docs)}), 200
+
+
+@api.route("/activity/content/<id>", methods=["get"])
+def content_activity(id):
+    """
+    Returns the votes of a content per hour.
+
+    Path parameters
+    ---------------
+        id: str
+            The id of the content.
+
+    Query parameters
+    ----------------
+        hours: int
+            Number of hours back, the current one included. Default 48.
+
+    Response codes
+    --------------
+        200
+            The hourly buckets with votes, oldest first: votes, wins,
+            losses and the ELO at the end of the hour.
+
+        400
+            If the id or hours are not valid.
+    """
+
+    return activity(db.rollups_content, "content_id", id)
+
+
+@api.route("/activity/contest/<id>", methods=["get"])
+def contest_activity(id):
+    """
+    Returns the votes of a contest per hour.
+
+    Path parameters
+    ---------------
+        id: str
+            The id of the contest.
+
+    Query parameters
+    ----------------
+        Same as /activity/content/<id>.
+
+    Response codes
+    --------------
+        200
+            The hourly buckets with votes, oldest first.
+
+        400
+            If the id or hours are not valid.
+    """
+
+    return activity(db.rollups_contest, "contest_id", id)
+
+
+@api.route("/ranking2", methods=["get"])
 def ranking2():
     """
     Returns the ranking (vote based)
 
+    Query parameters
+    ----------------
+        score: str, optional
+            "ratio" (up / total, default), "net" (up - down) or
+            "wilson" (Wilson score lower bound).
+
+        limit: int, optional
+            Page size.
+
+        cursor: str, optional
+            The "next" cursor of the previous page.
+
+        stream: bool, optional
+            Streams the whole list instead, ignores limit and cursor.
+
     Response codes
     --------------
         200
-            Ranking list, ordered desc.
+            A page of the ranking list, ordered desc, and the cursor of
+            the next one.
+
+        400
+            If the score, limit or cursor are not valid.
     """
 
-    ranking = db.content.aggregate([
-            {
-                "$match": {"votes.total": {"$gt": 0}}
-            },
-            {
-                "$project": {
-                    "_id": 1,
-                    "user_id": 1,
-                    "created": 1,
-                    "content": 1,
-                    "score_p": {
-                        "$divide": [
-                            "$votes.up",
-                            "$votes.total"
-                            ]
-                        },
-                    "score_v": {"$subtract": ["$votes.up", "$votes.down"]}
-                }
-            },
-            {
-                "$sort": {"score_p": -1}
-            }
-        ])
+    score = request.args.get("score", "ratio")
+
+    if score not in SCORES:
+        return error(f"'score' should be one of {', '.join(SCORES)}")
+
+    field = "scores." + score
+    query = {"votes.total": {"$gt": 0}}
+    projection = {"_id": 1, "user_id": 1, "created": 1, "content": 1, "scores": 1}
+    sort = [(field, -1), ("_id", 1)]
+
+    def rows(ranking):
+        for r in ranking:
+            yield dict(r, score_p=r["scores"]["ratio"], score_v=r["scores"]["net"])
+
+    if request.args.get("stream"):
+        return stream_json(rows(db.content.find(query, projection).sort(sort)), CONTENT)
+
+    try:
+        limit, cursor = page_args(request.args, RANK_CURSOR)
+    except ValueError as e:
+        return error(message=str(e))
+
+    if cursor is not None:
+        query["$or"] = [
+            {field: {"$lt": cursor[0]}},
+            {field: cursor[0], "_id": {"$gt": cursor[1]}}
+        ]
+
+    data = list(rows(db.content.find(query, projection).sort(sort).limit(limit)))
+
+    next = None
+
+    if len(data) == limit:
+        next = encode_cursor(data[-1]["scores"][score], data[-1]["_id"])
+
+    return dumps({"data": CONTENT.many(data), "next": next}), 200
+
+
+@api.route("/metrics", methods=["get"])
+def get_metrics():
+    """
+    Request, Mongo, hashing and vote buffer metrics.
+
+    Response codes
+    --------------
+        200
+            Metrics in Prometheus text format.
+    """
 
-    return dumps({"data": [r for r in ranking]}), 200
+    return metrics.registry.render(), 200, {"Content-Type": "text/plain; version=0.0.4"}
 
 
 # Auth endpoints
 
-@app.route("/", methods=["get"])
+@api.route("/", methods=["get"])
 @auth
 def index():
     user = db_get_user(request.jwt_data)
 
     try:
-        content = db.content.find({"user_id": user["_id"]})
+        content = [
+            *db.content.find({"user_id": user["_id"]}),
+            *db.content_archive.find({"user_id": user["_id"]})
+        ]
     except Exception:
         return error(message="User not found", code=404)
 
-    return dumps({"data": {"user": user, "content": content}})
+    return dumps({"data": {"user": USER(user), "content": CONTENT.many(content)}})
 
 
-@app.route("/content", methods=["post"])
+@api.route("/content", methods=["post"])
 @auth
 def content_post():
     """
@@ -442,13 +937,16 @@ def content_post():
 
         404
             If the user is not found.
+
+        409
+            If the contest is closed.
     """
 
     data = request.json    
     user = db_get_user(request.jwt_data)
 
     if "contest_id" not in data:
-        contest = db.contest.find_one({"current": True})
+        contest = contests.current(db)
         # return error(message="No 'contest_id' given")
 
     else:
@@ -457,15 +955,8 @@ def content_post():
     if contest is None:
         return error(message="Contest not found", code=404)
 
-    try:
-        _c = db.content.find_one({"user_id": user["_id"], "contest_id": contest["_id"]}) 
-
-        if _c is not None:
-            return error("Content already exists", 400)
-
-    except Exception as e:
-        log.error(e)
-        return error(f"Raised exception: {e}", 400)
+    if is_closed(db, contest["_id"]):
+        return error(message="Contest is closed", code=409)
 
     try:
         content = {
@@ -482,10 +973,19 @@ def content_post():
                 "up": 0,
                 "down": 0,
                 "elo": R0
-            }
+            },
+            "scores": initial_scores()
         }
 
+        # One content per user and contest (see indexes.py)
         content_id = db.content.insert_one(content).inserted_id
+        leaderboard.update_many([content])
+        contest_leaderboards.update_many([content])
+        match_pool.update_many([content])
+        versions.bump_contents([content])
+
+    except DuplicateKeyError:
+        return error("Content already exists", 400)
 
     except Exception as e:
         log.error(e)
@@ -494,7 +994,112 @@ def content_post():
     return {"message": f"Content uploaded", "content_id": str(content_id)}, 200
 
 
-@app.route("/stack", methods=["get"])
+@api.route("/contest/<id>/current", methods=["post"])
+@auth
+@admin
+def switch_contest(id):
+    """
+    Make a contest the current one (admin only).
+
+    Path parameters
+    ---------------
+        id: str
+            The id of the contest.
+
+    Response codes
+    --------------
+        200
+            The new current contest.
+
+        400
+            If the id is not valid.
+
+        403
+            If the user is not an admin.
+
+        404
+            If the contest is not found.
+
+        409
+            If the contest is closed.
+    """
+
+    try:
+        _id = ObjectId(id)
+    except Exception as e:
+        return error(f"Raised exception: {e}", 400)
+
+    if is_closed(db, _id):
+        return error("Contest is closed", 409)
+
+    contest = contests.switch(db, _id)
+
+    if contest is None:
+        return error("Contest not found", 404)
+
+    versions.bump("contest")
+
+    return dumps({"data": CONTEST(contest)}), 200
+
+
+@api.route("/contest/<id>/close", methods=["post"])
+@auth
+@admin
+def close_past_contest(id):
+    """
+    Close a past contest (admin only).
+
+    Its final ranking is frozen in snapshots, served by
+    /ranking/<contest_id>, and its contents move to the archive.
+
+    Path parameters
+    ---------------
+        id: str
+            The id of the contest.
+
+    Response codes
+    --------------
+        200
+            The closed contest.
+
+        400
+            If the id is not valid, it is the current contest or it has
+            not ended yet.
+
+        403
+            If the user is not an admin.
+
+        404
+            If the contest is not found.
+    """
+
+    try:
+        _id = ObjectId(id)
+    except Exception as e:
+        return error(f"Raised exception: {e}", 400)
+
+    board = contest_leaderboards.get(db, _id)
+
+    try:
+        contest = close_contest(db, _id)
+    except ValueError as e:
+        return error(str(e), 400)
+
+    if contest is None:
+        return error("Contest not found", 404)
+
+    # Out of this process memory, others reload on their TTL
+    for _c in list(board.docs) if board is not None else []:
+        leaderboard.remove(_c)
+        match_pool.remove(_c)
+
+    contest_leaderboards.remove(_id)
+    versions.bump("ranking")
+
+    return dumps({"data": CONTEST(contest)}), 200
+
+
+@api.route("/stack", methods=["get"])
 @auth
 def get_user_stack():
     """
@@ -515,19 +1120,32 @@ def get_user_stack():
 
         404
             If the user is not found.
+
+        429
+            Rate limited, with Retry-After.
     """
 
     user = db_get_user(request.jwt_data)
 
-    content = db.content.aggregate([
-            {"$match": {"user_id": {"$ne": user["_id"]}}},
-            {"$sample": {"size": 2}}
-        ])
+    def unseen(a, b):
+        return not seen.contains(user["_id"], a["_id"], b["_id"])
 
-    return dumps({"data": [c for c in content]}), 200
+    # Out of the pool lock, `pair` must not wait on the db
+    seen.warm(user["_id"])
 
+    match_pool.ensure(db)
+    content = match_pool.pair(user["_id"], accept=unseen)
 
-@app.route("/vote", methods=["post"])
+    if content is None:
+        content = db.content.aggregate([
+                {"$match": {"user_id": {"$ne": user["_id"]}}},
+                {"$sample": {"size": 2}}
+            ])
+
+    return dumps({"data": CONTENT.many(content)}), 200
+
+
+@api.route("/vote", methods=["post"])
 @auth
 def vote_content():
     """
@@ -551,6 +1169,9 @@ def vote_content():
         200
             Vote has been registered.
 
+        202
+            Vote has been queued (VOTE_BUFFER mode).
+
         400
             Bad request.
 
@@ -559,6 +1180,12 @@ def vote_content():
 
         404
             If any object is not found.
+
+        429
+            Rate limited, with Retry-After.
+
+        503
+            Vote queue is full (VOTE_BUFFER mode).
     """
 
     data = request.json
@@ -594,28 +1221,154 @@ def vote_content():
     if win["user_id"] == user["_id"] or los["user_id"] == user["_id"]:
         return error("No autovotes permited", 401)    
 
-    if win is los:
+    if win["_id"] == los["_id"]:
         return error("Winner and looser should be different", 400)    
 
-    query_win, query_los = update_elo(win, los)
-    
-    update = db.content.bulk_write([
-            UpdateOne(query_win[0], query_win[1]),
-            UpdateOne(query_los[0], query_los[1])
-        ])
-
-    db.votes.insert_one({
+    vote = {
         "user": user["_id"],
         "win": win["_id"],
         "los": los["_id"],
         "created": datetime.now() 
-    })
+    }
+
+    if VOTE_BUFFER:
+        try:
+            vote_buffer.put(vote)
+
+        except Full:
+            return error("Too many votes, try again later", 503)
+
+        journal.append(vote)
+        seen.add(user["_id"], win["_id"], los["_id"])
+
+        return ok("Vote queued", 202)
+
+    db.votes.insert_one(vote)
+    journal.append(vote)
+    seen.add(user["_id"], win["_id"], los["_id"])
+
+    win, los = db_vote(win, los)
+    modified = sum(c is not None for c in (win, los))
+
+    record(db, [vote], {c["_id"]: c for c in (win, los) if c is not None})
+
+    log.info(f"Vote registered: {modified} contents modified.")
+
+    return ok(f"Vote registered: {modified} contents modified.")
+
+
+@api.route("/votes", methods=["post"])
+@auth
+def vote_many():
+    """
+    Vote several pairs of content at once, in order.
+
+    Every vote is checked like in /vote, against a single fetch of all
+    the contents involved. The valid ones are applied in order, each one
+    seeing the ratings left by the previous ones.
+
+    Headers
+    -------
+        Authorization: str
+            JWT totken of the user.
+
+    JSON Body
+    ---------
+        Array of {"win": str, "los": str}, at most VOTES_MAX (or an
+        object with the array in "votes").
+
+    Response code
+    -------------
+        200
+            A result for every vote, in order: {"code", "message"}, with
+            the code /vote would have answered.
+
+        400
+            If the body is not a valid array.
+
+        429
+            Rate limited, with Retry-After.
+    """
+
+    data = request.json
+    items = data.get("votes") if isinstance(data, dict) else data
+
+    if not isinstance(items, list) or not items:
+        return error("Expected a non empty array of votes", 400)
+
+    if len(items) > VOTES_MAX:
+        return error(f"At most {VOTES_MAX} votes at once", 400)
+
+    user = db_get_user(request.jwt_data)
+    pairs = []
+
+    for item in items:
+        try:
+            pairs.append((ObjectId(item["win"]), ObjectId(item["los"])))
+        except Exception as e:
+            pairs.append(e)
+
+    ids = {_id for p in pairs if isinstance(p, tuple) for _id in p}
+    content = {c["_id"]: c for c in db.content.find({"_id": {"$in": list(ids)}})}
+
+    results, votes = [], []
+    now = datetime.now()
+
+    for pair in pairs:
+        if not isinstance(pair, tuple):
+            results.append({"code": 400, "message": f"Raised exception: {pair}"})
+            continue
+
+        win, los = content.get(pair[0]), content.get(pair[1])
+
+        if win is None or los is None:
+            missing = pair[0] if win is None else pair[1]
+            results.append({"code": 404, "message": f"Content {missing} not found"})
+
+        elif win["user_id"] == user["_id"] or los["user_id"] == user["_id"]:
+            results.append({"code": 401, "message": "No autovotes permited"})
+
+        elif win["_id"] == los["_id"]:
+            results.append({"code": 400, "message": "Winner and looser should be different"})
+
+        else:
+            results.append(None)
+            votes.append({"user": user["_id"], "win": win["_id"], "los": los["_id"],
+                          "created": now})
+
+    if VOTE_BUFFER:
+        applied, accepted = [], []
+
+        for vote in votes:
+            try:
+                vote_buffer.put(vote)
+                applied.append({"code": 202, "message": "Vote queued"})
+                accepted.append(vote)
+
+            except Full:
+                applied.append({"code": 503, "message": "Too many votes, try again later"})
+
+    else:
+        if votes:
+            db_vote_many(votes, content)
+
+        applied = [{"code": 200, "message": "Vote registered"}] * len(votes)
+        accepted = votes
+
+    # Only the accepted votes, the rejected ones are never applied
+    journal.append_many(accepted)
+
+    for vote in accepted:
+        seen.add(user["_id"], vote["win"], vote["los"])
+
+    applied = iter(applied)
+    results = [r or next(applied) for r in results]
 
-    log.info(update.bulk_api_result)
+    log.info(f"{len(votes)} of {len(items)} votes registered.")
 
-    return ok(f"Vote registered: {update.bulk_api_result['nModified']} contents modified.")
+    return {"data": results}, 200
 
 
 if __name__ == "__main__":
-    db = DB
+    app = create_app()
     app.run(host=HOST, port=PORT, debug=DEBUG)
@@ -0,0 +1,127 @@
+from math import sqrt
+
+
+# Confidence of the Wilson lower bound (95%)
+Z = 1.96
+
+
+def wilson(up, total, z=Z):
+    """Lower bound of the Wilson score interval of up / total votes."""
+
+    if total == 0:
+        return 0.
+
+    p = up / total
+    return (p + z*z / (2*total) - z * sqrt((p * (1 - p) + z*z / (4*total)) / total)) / (1 + z*z / total)
+
+
+def _wilson_expr(z=Z):
+    """`wilson` as an aggregation expression over the votes counters."""
+
+    n, up = "$votes.total", "$votes.up"
+    z2 = z * z
+
+    return {
+        "$cond": [
+            {"$gt": [n, 0]},
+            {
+                "$let": {
+                    "vars": {"p": {"$divide": [up, n]}},
+                    "in": {
+                        "$divide": [
+                            {
+                                "$subtract": [
+                                    {"$add": ["$$p", {"$divide": [z2 / 2, n]}]},
+                                    {
+                                        "$multiply": [
+                                            z,
+                                            {
+                                                "$sqrt": {
+                                                    "$divide": [
+                                                        {
+                                                            "$add": [
+                                                                {"$multiply": ["$$p", {"$subtract": [1, "$$p"]}]},
+                                                                {"$divide": [z2 / 4, n]}
+                                                            ]
+                                                        },
+                                                        n
+                                                    ]
+                                                }
+                                            }
+                                        ]
+                                    }
+                                ]
+                            },
+                            {"$add": [1, {"$divide": [z2, n]}]}
+                        ]
+                    }
+                }
+            },
+            0.
+        ]
+    }
+
+
+# Update pipeline stage computing the scores from the votes counters
+SCORES_STAGE = {
+    "$set": {
+        "scores.ratio": {
+            "$cond": [
+                {"$gt": ["$votes.total", 0]},
+                {"$divide": ["$votes.up", "$votes.total"]},
+                0.
+            ]
+        },
+        "scores.net": {"$subtract": ["$votes.up", "$votes.down"]},
+        "scores.wilson": _wilson_expr()
+    }
+}
+
+# Scores by name, as used by /ranking2
+SCORES = ("ratio", "net", "wilson")
+
+
+def scored(update):
+    """
+    Turns an `$inc` / `$set` update into an update pipeline that also
+    recomputes the scores, so both happen in the same write.
+    """
+
+    fields = {}
+
+    for key, value in update.get("$inc", {}).items():
+        fields[key] = {"$add": [{"$ifNull": ["$" + key, 0]}, value]}
+
+    for key, value in update.get("$set", {}).items():
+        fields[key] = {"$literal": value}
+
+    return [{"$set": fields}, SCORES_STAGE]
+
+
+def initial_scores():
+    return {"ratio": 0., "net": 0, "wilson": 0.}
+
+
+def scores_of(votes):
+    """`SCORES_STAGE` in memory, the scores of some votes counters."""
+
+    up, total = votes.get("up", 0), votes.get("total", 0)
+
+    return {
+        "ratio": up / total if total > 0 else 0.,
+        "net": up - votes.get("down", 0),
+        "wilson": wilson(up, total)
+    }
+
+
+def backfill(db, missing=False):
+    """Computes the scores of all the content, or only where missing."""
+
+    query = {"scores": {"$exists": False}} if missing else {}
+    return db.content.update_many(query, [SCORES_STAGE]).modified_count
+
+
+if __name__ == "__main__":
+    from database import db
+
+    print(f"Scores updated: {backfill(db)} contents.")
@@ -0,0 +1,156 @@
+import atexit
+
+from collections import OrderedDict
+from hashlib import blake2b
+from math import ceil
+from math import log as ln
+from threading import Lock
+
+from bson.binary import Binary
+from bson.objectid import ObjectId
+
+from config import LOGGER as log
+from config import SEEN_CAPACITY, SEEN_ERROR, SEEN_USERS, SEEN_SAVE_EVERY
+from database import db
+
+
+class BloomFilter:
+    """
+    Bloom filter sized for `capacity` keys at an `error` false positive
+    rate. Positions come from one blake2b digest (double hashing).
+    """
+
+    def __init__(self, capacity, error, bits=None, count=0):
+        self.capacity = capacity
+        self.error = error
+        self.size = max(8, ceil(-capacity * ln(error) / ln(2)**2))
+        self.hashes = max(1, round(self.size / capacity * ln(2)))
+        self.count = count
+
+        self.bits = bytearray(bits) if bits is not None else bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        digest = blake2b(key, digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little")
+
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def __contains__(self, key):
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self._positions(key))
+
+    def add(self, key):
+        for p in self._positions(key):
+            self.bits[p >> 3] |= 1 << (p & 7)
+
+        self.count += 1
+
+    @property
+    def full(self):
+        return self.count >= self.capacity
+
+
+class SeenPairs:
+    """
+    Pairs of content each user already voted, one Bloom filter per user.
+
+    Filters of the last `users` users are kept in memory and persisted in
+    `db.seen`, every `save_every` new pairs, when evicted and at exit. A
+    filter holding `capacity` pairs starts over, so memory per user is
+    bounded and the false positive rate stays under `error`.
+    """
+
+    def __init__(self, capacity=SEEN_CAPACITY, error=SEEN_ERROR, users=SEEN_USERS,
+                 save_every=SEEN_SAVE_EVERY):
+        self.capacity = capacity
+        self.error = error
+        self.users = users
+        self.save_every = save_every
+
+        self._filters = OrderedDict()
+        self._unsaved = {}
+        self._lock = Lock()
+
+        atexit.register(self.save_all)
+
+    @staticmethod
+    def key(a, b):
+        """Same key whatever the order of the pair."""
+
+        a, b = ObjectId(a).binary, ObjectId(b).binary
+        return a + b if a < b else b + a
+
+    def _load(self, user_id):
+        doc = db.seen.find_one({"_id": user_id})
+
+        if doc is None or doc["capacity"] != self.capacity or doc["error"] != self.error:
+            return BloomFilter(self.capacity, self.error)
+
+        return BloomFilter(self.capacity, self.error, doc["bits"], doc["count"])
+
+    def _get(self, user_id):
+        with self._lock:
+            bloom = self._filters.get(user_id)
+
+            if bloom is not None:
+                self._filters.move_to_end(user_id)
+                return bloom
+
+        bloom = self._load(user_id)
+        evicted = []
+
+        with self._lock:
+            bloom = self._filters.setdefault(user_id, bloom)
+
+            while len(self._filters) > self.users:
+                evicted.append(self._filters.popitem(last=False))
+
+        for evicted_id, evicted_bloom in evicted:
+            if self._unsaved.pop(evicted_id, 0):
+                self._save(evicted_id, evicted_bloom)
+
+        return bloom
+
+    def _save(self, user_id, bloom):
+        try:
+            db.seen.replace_one({"_id": user_id}, {
+                "capacity": bloom.capacity,
+                "error": bloom.error,
+                "count": bloom.count,
+                "bits": Binary(bytes(bloom.bits))
+            }, upsert=True)
+
+        except Exception as e:
+            log.error(f"Could not save seen pairs of {user_id}: {e}")
+
+    def warm(self, user_id):
+        """Loads the filter of a user, so `contains` does not read the db."""
+        self._get(user_id)
+
+    def contains(self, user_id, a, b):
+        """If the user (probably) voted the pair."""
+        return self.key(a, b) in self._get(user_id)
+
+    def add(self, user_id, a, b):
+        bloom = self._get(user_id)
+
+        with self._lock:
+            if bloom.full:
+                bloom = self._filters[user_id] = BloomFilter(self.capacity, self.error)
+
+            bloom.add(self.key(a, b))
+            unsaved = self._unsaved[user_id] = self._unsaved.get(user_id, 0) + 1
+
+        if unsaved >= self.save_every:
+            self._unsaved.pop(user_id, None)
+            self._save(user_id, bloom)
+
+    def save_all(self):
+        with self._lock:
+            pending = [(u, self._filters[u]) for u in self._unsaved if u in self._filters]
+            self._unsaved.clear()
+
+        for user_id, bloom in pending:
+            self._save(user_id, bloom)
+
+
+seen = SeenPairs()
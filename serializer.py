@@ -0,0 +1,99 @@
+import json
+
+from datetime import datetime
+
+from bson import json_util
+from bson.objectid import ObjectId
+
+from config import WIRE_FORMAT
+
+
+# How ObjectId and datetime values are written, by wire format.
+# "extended" is what bson.json_util.dumps writes ($oid / $date).
+FORMATS = {
+    "extended": {
+        ObjectId: lambda v: {"$oid": str(v)},
+        datetime: json_util.default
+    },
+    "plain": {
+        ObjectId: str,
+        datetime: datetime.isoformat
+    }
+}
+
+
+class Shape:
+    """
+    Encoder of a known document shape.
+
+    The ObjectId and datetime fields of the shape are converted with a
+    precompiled list of (field, type, converter), instead of walking the
+    whole document like `json_util.dumps`. Anything else is left to the
+    `dumps` fallback.
+
+    Parameters
+    ----------
+        oids: tuple
+            ObjectId fields
+
+        dates: tuple
+            datetime fields
+
+        wire: str
+            Wire format, a key of FORMATS
+    """
+
+    def __init__(self, oids=(), dates=(), wire=WIRE_FORMAT):
+        convert = FORMATS[wire]
+
+        self.fields = tuple(
+            [(f, ObjectId, convert[ObjectId]) for f in oids] +
+            [(f, datetime, convert[datetime]) for f in dates])
+
+    def __call__(self, doc):
+        """Converts a document, anything but a dict is returned as is."""
+
+        if not isinstance(doc, dict):
+            return doc
+
+        out = dict(doc)
+
+        for field, cls, convert in self.fields:
+            value = out.get(field)
+
+            if value.__class__ is cls:
+                out[field] = convert(value)
+
+        return out
+
+    def many(self, docs):
+        """Converts an iterable of documents (a cursor works) to a list."""
+        return [self(doc) for doc in docs]
+
+
+CONTENT = Shape(oids=("_id", "user_id", "contest_id"), dates=("created",))
+USER = Shape(oids=("_id",), dates=("created",))
+CONTEST = Shape(oids=("_id",), dates=("start", "end", "created"))
+ROLLUP = Shape(oids=("content_id", "contest_id"), dates=("hour",))
+
+
+def _plain_default(obj):
+    if isinstance(obj, ObjectId):
+        return str(obj)
+
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+
+    return json_util.default(obj)
+
+
+def dumps(obj, wire=WIRE_FORMAT):
+    """
+    Encodes shape-converted documents to JSON.
+
+    Values the shapes did not convert go through `json_util.default`
+    (or its plain equivalent), so the output is still complete.
+    """
+
+    default = json_util.default if wire == "extended" else _plain_default
+    return json.dumps(obj, default=default)
@@ -1,15 +1,24 @@
-from random import choice
+import json
+
+from argparse import ArgumentParser
+from random import choice, random
 from string import ascii_lowercase as letters
 
 from datetime import datetime
-from time import time
+from threading import Lock, Thread
+from time import time, perf_counter
 
 from os import environ
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
 from dotenv import load_dotenv
 
 from pymongo import MongoClient
 from bson.objectid import ObjectId
 
+from elo import update_elo
+
 
 def random_str(length=8):
     return "".join(choice(letters) for _ in range(length))
@@ -22,18 +31,23 @@ class TestDB:
 
     N = 0
 
-    def __init__(self, n=100):
+    def __init__(self, n=100, db=None, prefix="test_", purge=True):
         # Load the database
 
-        load_dotenv()
+        if db is None:
+            load_dotenv()
 
-        if bool(environ["LOCAL"]):
-            mongo = MongoClient(environ["MONGO_HOST"], int(environ["MONGO_PORT"]))
-            self.db = mongo.jiz
+            if bool(environ["LOCAL"]):
+                mongo = MongoClient(environ["MONGO_HOST"], int(environ["MONGO_PORT"]))
+                db = mongo.jiz
 
-        else:
-            mongo = MongoClient(environ["MONGO_URI"])
-            self.db = mongo.jiz
+            else:
+                mongo = MongoClient(environ["MONGO_URI"])
+                db = mongo.jiz
+
+        self.db = db
+        self.prefix = prefix
+        self.users, self.content = {}, {}
 
         self.N = n
         print(f"Number of users: {self.N}")
@@ -45,7 +59,7 @@ class TestDB:
 
         # Create dummy data
         t = time()
-        
+
         self.create_contest()
 
         for _ in range(self.N):
@@ -53,7 +67,7 @@ class TestDB:
                 self.create_user()
             except Exception as e:
                 print(f"Could not create user: {e}")
-        
+
 
         for _, u in self.users.items():
             try:
@@ -67,33 +81,26 @@ class TestDB:
 
         # Delete the test collections
 
-        self.purge()
+        if purge:
+            self.purge()
 
 
-    def create_collections(self):
-        try:
-            self.db.create_collection("test_contest")
-        except Exception:
-            pass
-        
-        try:
-            self.db.create_collection("test_users")
-        except Exception:
-            pass
-        
-        try:
-            self.db.create_collection("test_content")
-        except Exception:
-            pass
+    def collection(self, name):
+        return self.db[self.prefix + name]
 
-        try:
-            self.db.create_collection("test_votes")
-        except Exception:
-            pass
+
+    def create_collections(self):
+        for name in ("contest", "users", "content", "votes"):
+            try:
+                self.db.create_collection(self.prefix + name)
+            except Exception:
+                pass
 
 
     def create_contest(self):
-        contest_id = self.db.test_contest.insert_one({
+        now = datetime.now()
+
+        contest_id = self.collection("contest").insert_one({
             "title": random_str(),
             "description": random_str(),
             "prize": random_str(),
@@ -101,35 +108,40 @@ class TestDB:
                 "type": "text",
                 "max": 100
             },
+            "start": now,
+            "end": now.replace(year=now.year + 1),
             "current": True,
             "test": True
         }).inserted_id
 
-        self.contest = self.db.test_contest.find_one({"_id": contest_id})
+        self.contest = self.collection("contest").find_one({"_id": contest_id})
         print(f"Contest created: {contest_id}")
 
 
     def create_user(self):
-        user_id = self.db.test_users.insert_one({
+        user_id = self.collection("users").insert_one({
             "username": random_str(),
             "email": random_str(),
             "description": random_str(),
             "password": random_str(),
+            "created": datetime.now(),
             "test": True
         }).inserted_id
 
-        self.users[str(user_id)] = self.db.test_users.find_one({"_id": user_id})
+        self.users[str(user_id)] = self.collection("users").find_one({"_id": user_id})
         # print(f"User created: {user_id}")
 
 
     def create_content(self, user_id):
-        content_id = self.db.test_content.insert_one({
+        content_id = self.collection("content").insert_one({
             "user_id": user_id,
             "content": {
-                "data": " ".join(random_str() for _ in range(12))
+                "data": " ".join(random_str() for _ in range(12)),
+                "type": "text",
+                "url": ""
             },
             "created": datetime.now(),
-            "contest": self.contest["_id"],
+            "contest_id": self.contest["_id"],
             "votes": {
                 "elo": 1500,
                 "up": 0,
@@ -139,31 +151,236 @@ class TestDB:
             "test": True
         }).inserted_id
 
-        self.content[str(content_id)] = self.db.test_content.find_one({"_id": content_id})
+        self.content[str(content_id)] = self.collection("content").find_one({"_id": content_id})
         # print(f"Content created: {content_id}")
 
     def vote(self, user_id, win, los):
-        pass
+        content = self.collection("content")
+        win = content.find_one({"_id": ObjectId(win)})
+        los = content.find_one({"_id": ObjectId(los)})
+
+        for query, update in update_elo(win, los):
+            content.update_one({"_id": query["_id"]}, update)
+
+        self.collection("votes").insert_one({
+            "user": ObjectId(user_id),
+            "win": win["_id"],
+            "los": los["_id"],
+            "created": datetime.now(),
+            "test": True
+        })
 
     def purge(self):
         print("Purging all test data.")
 
-        print("Contest...", end="")
-        self.db.drop_collection("test_contest")
-        print("done.")
+        for name in ("contest", "users", "content", "votes"):
+            print(f"{name.capitalize()}...", end="")
+            self.db.drop_collection(self.prefix + name)
+            print("done.")
+
+
+class AppClient:
+    """Requests to the app in-process, through its test client."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None, token=None):
+        headers = {"Authorization": f"Bearer {token}"} if token else {}
+        response = self.client.open(path, method=method, json=data, headers=headers)
+        return response.status_code, response.get_data()
+
+
+class HttpClient:
+    """Requests to a running server."""
+
+    def __init__(self, url):
+        self.url = url.rstrip("/")
+
+    def request(self, method, path, data=None, token=None):
+        body = None if data is None else json.dumps(data).encode()
+        request = Request(self.url + path, data=body, method=method)
+
+        if data is not None:
+            request.add_header("Content-Type", "application/json")
+
+        if token:
+            request.add_header("Authorization", f"Bearer {token}")
+
+        try:
+            with urlopen(request) as response:
+                return response.status, response.read()
+
+        except HTTPError as e:
+            return e.code, e.read()
 
-        print("Users...", end="")
-        self.db.drop_collection("test_users")
-        print("done.")
 
-        print("Content...", end="")
-        self.db.drop_collection("test_content")
-        print("done.")
+def percentile(values, p):
+    """Nearest-rank percentile of sorted values."""
+
+    if not values:
+        return None
+
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+class LoadTest:
+    """
+    Latency benchmark of the endpoints.
+
+    Runs `voters` concurrent simulated voters. Each one registers, logs
+    in and votes `votes` times (/stack then /vote), reading /ranking and
+    /content every `read_every` votes.
+    """
+
+    def __init__(self, client, voters=8, votes=100, read_every=10):
+        self.client = client
+        self.voters = voters
+        self.votes = votes
+        self.read_every = read_every
+
+        self.samples = {}
+        self._lock = Lock()
+
+    def call(self, name, method, path, data=None, token=None):
+        t = perf_counter()
+        status, body = self.client.request(method, path, data, token)
+        t = perf_counter() - t
+
+        with self._lock:
+            sample = self.samples.setdefault(name, {"latency": [], "errors": 0})
+            sample["latency"].append(t)
+            sample["errors"] += status >= 400
+
+        return status, body
+
+    def voter(self):
+        user = {"username": random_str(12), "email": f"{random_str()}@{random_str()}.com",
+                "password": random_str(12)}
+
+        self.call("/register", "post", "/register", user)
+        status, body = self.call("/login", "post", "/login",
+                                 {"username": user["username"], "password": user["password"]})
+
+        if status != 200:
+            print(f"Could not log in: {body}")
+            return
+
+        token = json.loads(body)["token"]
+
+        for i in range(self.votes):
+            status, body = self.call("/stack", "get", "/stack", token=token)
+
+            if status == 200:
+                pair = json.loads(body)["data"]
+
+                if len(pair) == 2:
+                    win, los = (pair[0], pair[1]) if random() < .5 else (pair[1], pair[0])
+                    self.call("/vote", "post", "/vote",
+                              {"win": win["_id"]["$oid"], "los": los["_id"]["$oid"]}, token)
+
+            if self.read_every and i % self.read_every == 0:
+                self.call("/ranking", "get", "/ranking")
+                self.call("/content", "get", "/content")
+
+    def run(self):
+        threads = [Thread(target=self.voter) for _ in range(self.voters)]
+
+        t = perf_counter()
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        return self.report(perf_counter() - t)
+
+    def report(self, elapsed):
+        endpoints = {}
+
+        for name, sample in sorted(self.samples.items()):
+            latency = sorted(sample["latency"])
+
+            endpoints[name] = {
+                "count": len(latency),
+                "errors": sample["errors"],
+                "throughput": len(latency) / elapsed,
+                "mean_ms": sum(latency) / len(latency) * 1000,
+                "p50_ms": percentile(latency, 50) * 1000,
+                "p95_ms": percentile(latency, 95) * 1000,
+                "p99_ms": percentile(latency, 99) * 1000
+            }
+
+        return {
+            "created": datetime.now().isoformat(),
+            "voters": self.voters,
+            "votes": self.votes,
+            "elapsed_s": elapsed,
+            "endpoints": endpoints
+        }
 
-        print("Votes...", end="")
-        self.db.drop_collection("test_votes")
-        print("done.")
 
 if __name__ == "__main__":
-    TestDB(10)
+    parser = ArgumentParser(description="Seed test data, or benchmark the endpoints with --bench.")
+    parser.add_argument("-n", type=int, default=10, help="Users (and content) to seed")
+    parser.add_argument("--bench", action="store_true", help="Run the load test")
+    parser.add_argument("--db", default="jiz_bench",
+                        help="New database for the load test, dropped at the end")
+    parser.add_argument("--drop", action="store_true",
+                        help="Use (and drop at the end) --db even if it already exists")
+    parser.add_argument("--url", help="Benchmark a running server started with MONGO_DB=<--db> "
+                                      "and RATE_LIMITS=\"\" instead of the app in-process")
+    parser.add_argument("--voters", type=int, default=8)
+    parser.add_argument("--votes", type=int, default=100, help="Votes per voter")
+    parser.add_argument("--read-every", type=int, default=10)
+    parser.add_argument("--output", help="Write the JSON report to a file")
+    args = parser.parse_args()
+
+    if not args.bench:
+        TestDB(args.n)
+
+    else:
+        from config import MONGO_DB
+        from database import mongo
+        from leaderboard import leaderboard
+        from matchmaking import match_pool
+        from ratelimit import limiter
+        from run import create_app
+
+        # Only ever drop a database the bench owns
+        if args.db == MONGO_DB:
+            parser.error(f"--db {args.db} is the app database (MONGO_DB), use another one")
+
+        if args.db in mongo.client.list_database_names() and not args.drop:
+            parser.error(f"--db {args.db} already exists, pass --drop to use and drop it anyway")
+
+        app = create_app({"MONGO_DB": args.db})
+
+        # All the voters come from one address, measure the endpoints, not
+        # the rate limits
+        limiter.limits = {}
+
+        with app.app_context():
+            try:
+                # Seeded after startup, so load them
+                TestDB(args.n, db=mongo.db, prefix="", purge=False)
+                leaderboard.load(mongo.db.content.find())
+                match_pool.load(mongo.db.content.find())
+
+                client = HttpClient(args.url) if args.url else AppClient(app)
+                report = LoadTest(client, voters=args.voters, votes=args.votes,
+                                  read_every=args.read_every).run()
+
+            finally:
+                mongo.client.drop_database(args.db)
+
+        report["users"] = args.n
+
+        output = json.dumps(report, indent=2)
+
+        if args.output:
+            with open(args.output, "w") as f:
+                f.write(output)
 
+        print(output)
@@ -1,7 +1,12 @@
 import re
 import jwt
 
-from config import JWT_SECRET, JWT_ALG
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from bson import json_util
+from flask import Response, stream_with_context
+
+from config import JWT_SECRET, JWT_ALG, PAGE_LIMIT, PAGE_MAX, STREAM_CHUNK
+from serializer import dumps
 
 regex = r"(?:[a-z0-9!#$%&'*+/=?^_`{|}~-]+(?:\.[a-z0-9!#$%&'*+/=?^_`{|}~-]+)*|\"(?:[\x01-\x08\x0b\x0c\x0e-\x1f\x21\x23-\x5b\x5d-\x7f]|\\[\x01-\x09\x0b\x0c\x0e-\x7f])*\")@(?:(?:[a-z0-9](?:[a-z0-9-]*[a-z0-9])?\.)+[a-z0-9](?:[a-z0-9-]*[a-z0-9])?|\[(?:(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\.){3}(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?|[a-z0-9-]*[a-z0-9]:(?:[\x01-\x08\x0b\x0c\x0e-\x1f\x21-\x5a\x53-\x7f]|\\[\x01-\x09\x0b\x0c\x0e-\x7f])+)\])"
 
@@ -32,6 +37,91 @@ def ok(message="Ok", code=200):
     return {"message": message}, code
 
 
-def error(message="Bad request", code=400):
+def error(message="Bad request", code=400, headers=None):
     """Sample HTTP 400 error response."""
+    if headers:
+        return {"message": message}, code, headers
+
     return {"message": message}, code
+
+
+def encode_cursor(*values):
+	"""Opaque pagination cursor from the sort key of the last item sent."""
+	return urlsafe_b64encode(json_util.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor):
+	"""Sort key of a cursor made by `encode_cursor`."""
+	return json_util.loads(urlsafe_b64decode(cursor.encode()).decode())
+
+
+def page_args(args, types, default=PAGE_LIMIT, maximum=PAGE_MAX):
+	"""
+	Reads the pagination query parameters.
+
+	Parameters
+	----------
+		args: MultiDict
+			Request query parameters, with optional "limit" and "cursor"
+
+		types: tuple
+			Expected type (or tuple of types) of every cursor value
+
+	Returns
+	-------
+		int, list
+			The page size and the decoded cursor (None for the first page)
+
+	Raises
+	------
+		ValueError
+			If any of them is not valid
+	"""
+
+	limit = int(args.get("limit", default))
+
+	if not 0 < limit <= maximum:
+		raise ValueError(f"'limit' should be between 1 and {maximum}")
+
+	cursor = args.get("cursor")
+
+	if cursor is not None:
+		try:
+			cursor = decode_cursor(cursor)
+		except Exception:
+			raise ValueError("Invalid 'cursor'")
+
+		if (not isinstance(cursor, list) or len(cursor) != len(types) or
+				not all(isinstance(v, t) and not isinstance(v, bool) for v, t in zip(cursor, types))):
+			raise ValueError("Invalid 'cursor'")
+
+	return limit, cursor
+
+
+def stream_json(docs, shape, key="data", chunk=STREAM_CHUNK):
+	"""
+	Streams `{key: [docs...]}` as a chunked JSON response.
+
+	Documents are encoded one by one with `shape` as they come from `docs`
+	(a cursor works), and sent in chunks of about `chunk` bytes, so memory
+	does not grow with the result size.
+	"""
+
+	def generate():
+		buffer, size = ['{"' + key + '": ['], 0
+		sep = ""
+
+		for doc in docs:
+			encoded = sep + dumps(shape(doc))
+			buffer.append(encoded)
+			size += len(encoded)
+			sep = ", "
+
+			if size >= chunk:
+				yield "".join(buffer)
+				buffer, size = [], 0
+
+		buffer.append("]}")
+		yield "".join(buffer)
+
+	return Response(stream_with_context(generate()), mimetype="application/json")
@@ -0,0 +1,139 @@
+import atexit
+import os
+
+from datetime import datetime
+from threading import Lock, Thread
+from time import sleep
+
+from pymongo import UpdateOne
+
+from cache import TTLCache
+from config import LOGGER as log
+from config import VERSION_CACHE_SIZE, VERSION_TTL
+from database import db
+
+
+class Versions:
+    """
+    Version counters of the data behind the polled endpoints.
+
+    Counters live in `db.versions`, as {_id: name, v, modified}, so every
+    process sees the same ones. Reads are cached `ttl` seconds.
+
+    Bumps are not written on the request: they are added up in process
+    and flushed by a background thread at most once every `ttl` seconds,
+    one bulk for all the names bumped meanwhile. This process sees its
+    own bumps at once, other ones at most about 2 * `ttl` later.
+
+    Names used:
+        "ranking"          any rating or content change
+        "contest"          current contest change
+        "content:<id>"     rating change of a content
+    """
+
+    def __init__(self, maxsize=VERSION_CACHE_SIZE, ttl=VERSION_TTL):
+        self.ttl = ttl
+
+        self._cache = TTLCache(maxsize, ttl)
+
+        # name: [increments, last bump (UTC)], not flushed yet
+        self._pending = {}
+        self._lock = Lock()
+        self._thread = None
+        self._pid = None
+
+        atexit.register(self.flush)
+
+    def get(self, name):
+        """
+        Returns
+        -------
+            int, datetime
+                Version and last change (UTC) of `name`, 0 and None if it
+                never changed
+        """
+
+        version = self._cache.get(name)
+
+        if version is None:
+            doc = db.versions.find_one({"_id": name}) or {}
+            version = (doc.get("v", 0), doc.get("modified"))
+            self._cache.set(name, version)
+
+        with self._lock:
+            pending = self._pending.get(name)
+
+        if pending is None:
+            return version
+
+        v, modified = version
+        return v + pending[0], max(modified, pending[1]) if modified else pending[1]
+
+    def bump(self, *names):
+        """Increments the counters of `names`, flushed later."""
+
+        now = datetime.utcnow()
+
+        with self._lock:
+            self._start()
+
+            for name in names:
+                pending = self._pending.setdefault(name, [0, now])
+                pending[0] += 1
+                pending[1] = now
+
+    def bump_contents(self, contents):
+        """Vote listener: the ranking and every updated content changed."""
+
+        self.bump("ranking", *(f"content:{c['_id']}" for c in contents if c is not None))
+
+    def flush(self):
+        """Writes the pending bumps, in one bulk."""
+
+        with self._lock:
+            pending = {name: tuple(p) for name, p in self._pending.items()}
+
+        if not pending:
+            return
+
+        try:
+            db.versions.bulk_write([
+                UpdateOne({"_id": name}, {"$inc": {"v": n}, "$max": {"modified": modified}},
+                          upsert=True)
+                for name, (n, modified) in pending.items()
+            ], ordered=False)
+
+        except Exception as e:
+            log.error(f"Could not flush {len(pending)} versions: {e}")
+            return
+
+        # Written: drop them from pending and read them again, together so
+        # a version never goes back
+        with self._lock:
+            for name, (n, _) in pending.items():
+                left = self._pending[name]
+                left[0] -= n
+
+                if left[0] <= 0:
+                    del self._pending[name]
+
+                self._cache.pop(name)
+
+    def _start(self):
+        # Under self._lock. Threads do not survive a fork, one per process,
+        # and bumps of the parent are flushed by the parent
+        if self._pid != os.getpid():
+            if self._pid is not None:
+                self._pending = {}
+
+            self._pid = os.getpid()
+            self._thread = Thread(target=self._run, name="versions", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            sleep(self.ttl)
+            self.flush()
+
+
+versions = Versions()